@@ -16,6 +16,8 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import asyncio
+import os
 import time
 import typing
 import bittensor as bt
@@ -25,7 +27,14 @@ import omega
 
 from omega.base.miner import BaseMinerNeuron
 from omega.imagebind_wrapper import ImageBind
-from omega.miner_utils import search_and_embed_videos
+from omega.imagebind_pool import ImageBindPool
+from omega.miner_utils import search_and_embed_videos, PipelineConfig
+from omega.embedding_cache import EmbeddingCache
+from omega.video_cache import VideoCache
+from omega.job_engine import JobEngine
+from omega.utils.misc import LRUCache
+from omega.prewarm import TopicPrewarmer
+from omega.inventory import VideoInventory
 from omega.augment import LocalLLMAugment, OpenAIAugment, NoAugment
 from omega.utils.config import QueryAugment
 from omega.constants import VALIDATOR_TIMEOUT
@@ -48,21 +57,110 @@ class Miner(BaseMinerNeuron):
         elif query_augment_type == QueryAugment.LocalLLMAugment:
             self.augment = LocalLLMAugment(device=self.config.neuron.device)
         elif query_augment_type == QueryAugment.OpenAIAugment:
-            self.augment = OpenAIAugment(device=self.config.neuron.device)
+            self.augment = OpenAIAugment(
+                device=self.config.neuron.device,
+                latency_budget=self.config.neuron.augment_latency_budget,
+                hedge_percentile=self.config.neuron.augment_hedge_percentile,
+            )
         else:
             raise ValueError("Invalid query augment")
-        self.imagebind = ImageBind()
+        self.imagebind = ImageBind(
+            snap_to_keyframes=self.config.neuron.snap_to_keyframes,
+            sparse_video_sampling=self.config.neuron.sparse_video_sampling,
+        )
+        if self.config.neuron.imagebind_workers > 0:
+            self.imagebind = ImageBindPool(self.imagebind, self.config.neuron.imagebind_workers)
+        self.pipeline_config = PipelineConfig.from_config(self.config)
+        self.embedding_cache = None
+        if self.config.neuron.embedding_cache_gb > 0:
+            self.embedding_cache = EmbeddingCache(
+                self.config.neuron.embedding_cache_dir
+                or os.path.join(self.config.neuron.full_path, "embedding_cache"),
+                max_bytes=int(self.config.neuron.embedding_cache_gb * 1024 ** 3),
+            )
+        self.video_cache = None
+        if self.config.neuron.video_cache_gb > 0:
+            self.video_cache = VideoCache(
+                self.config.neuron.video_cache_dir
+                or os.path.join(self.config.neuron.full_path, "video_cache"),
+                max_bytes=int(self.config.neuron.video_cache_gb * 1024 ** 3),
+            )
+        self.job_engine = JobEngine(
+            max_concurrent_jobs=self.config.neuron.max_concurrent_requests,
+            process_workers=self.config.neuron.ffmpeg_workers,
+        )
+        # validators often send the same query within seconds of each other
+        self.jobs_in_flight: typing.Dict[typing.Tuple[str, int], asyncio.Future] = {}
+        self.results_cache = LRUCache(maxsize=256, ttl=self.config.neuron.result_cache_ttl)
+
+        self.prewarmer = None
+        self.inventory = None
+        if self.config.neuron.prewarm:
+            if self.embedding_cache is None:
+                bt.logging.warning("Topic pre-warming needs the embedding cache, ignoring --neuron.prewarm")
+            else:
+                api_root = (
+                    "https://dev-validator.api.omega-labs.ai"
+                    if self.config.subtensor.network == "test" else
+                    "https://validator.api.omega-labs.ai"
+                )
+                # clips embedded by different models (or video loaders) must not be mixed
+                self.inventory = VideoInventory(
+                    os.path.join(self.config.neuron.inventory_dir, self.imagebind.model_version)
+                )
+                self.prewarmer = TopicPrewarmer(
+                    f"{api_root}/api/topics", self.imagebind, self.augment, self.job_engine,
+                    self.embedding_cache, self.video_cache, self.inventory,
+                    max_inventory_size=self.config.neuron.inventory_max_size,
+                    videos_per_topic=self.config.neuron.prewarm_videos_per_topic,
+                    refresh_interval=self.config.neuron.prewarm_interval,
+                    duty_cycle=self.config.neuron.prewarm_duty_cycle,
+                )
+                self.prewarmer.start()
+
+    async def search_and_embed(
+        self, query: str, num_videos: int, deadline: float
+    ) -> typing.List[omega.protocol.VideoMetadata]:
+        async with self.job_engine.job():
+            augmented_query = await self.augment.augment_async(query, self.job_engine.thread_pool)
+            video_metadata = await self.job_engine.run(
+                search_and_embed_videos,
+                augmented_query, num_videos, self.imagebind,
+                self.pipeline_config, self.embedding_cache, self.video_cache,
+                deadline=deadline,
+                ffmpeg_executor=self.job_engine.process_pool,
+                inventory=self.inventory,
+            )
+        if len(video_metadata) == num_videos and self.config.neuron.result_cache_ttl > 0:
+            self.results_cache.put((query, num_videos), video_metadata)
+        return video_metadata
 
     async def forward(
         self, synapse: omega.protocol.Videos
     ) -> omega.protocol.Videos:
         bt.logging.info(f"Received scraping request: {synapse.num_videos} videos for query '{synapse.query}'")
         start = time.time()
-        synapse.video_metadata = search_and_embed_videos(
-            self.augment(synapse.query), synapse.num_videos, self.imagebind
-        )
+        timeout = synapse.timeout or VALIDATOR_TIMEOUT
+        deadline = start + timeout - self.config.neuron.deadline_margin
+        key = (synapse.query, synapse.num_videos)
+        video_metadata = self.results_cache.get(key)
+        if video_metadata is not None:
+            bt.logging.info(f"Serving cached results for query '{synapse.query}'")
+        else:
+            job = self.jobs_in_flight.get(key)
+            if job is None:
+                job = asyncio.ensure_future(self.search_and_embed(synapse.query, synapse.num_videos, deadline))
+                self.jobs_in_flight[key] = job
+                job.add_done_callback(lambda _: self.jobs_in_flight.pop(key, None))
+            else:
+                bt.logging.info(f"Attaching to in-flight job for query '{synapse.query}'")
+            # shield the shared job so one caller timing out does not cancel it for the others
+            video_metadata = await asyncio.shield(job)
+        synapse.video_metadata = [
+            video.encode_embeddings(self.config.neuron.embedding_encoding) for video in video_metadata
+        ]
         time_elapsed = time.time() - start
-        if len(synapse.video_metadata) == synapse.num_videos and time_elapsed < VALIDATOR_TIMEOUT:
+        if len(synapse.video_metadata) == synapse.num_videos and time_elapsed < timeout:
             bt.logging.info(f"–––––– SCRAPING SUCCEEDED: Scraped {len(synapse.video_metadata)}/{synapse.num_videos} videos in {time_elapsed} seconds.")
         else:
             bt.logging.error(f"–––––– SCRAPING FAILED: Scraped {len(synapse.video_metadata)}/{synapse.num_videos} videos in {time_elapsed} seconds.")
@@ -155,6 +253,12 @@ class Miner(BaseMinerNeuron):
         )
         return prirority
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if self.prewarmer is not None:
+            self.prewarmer.stop()
+        self.job_engine.shutdown()
+
     def save_state(self):
         """
         We define this function to avoid printing out the log message in the BaseNeuron class
@@ -1,32 +1,139 @@
+import asyncio
+import collections
+import functools
+import json
+import os
+import threading
+import time
+from concurrent.futures import Executor
+from typing import List, Optional
+
 import bittensor as bt
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, OpenAI
 import torch
 from transformers import pipeline
 
+from omega.utils.misc import LRUCache
+
+
+AUGMENT_CACHE_PATH = "~/.cache/omega/augmented_queries.json"
+AUGMENT_CACHE_SIZE = 4096
+LOCAL_LLM_BATCH_SIZE = 8
+OPENAI_MODEL = "gpt-4-turbo-preview"
+OPENAI_MAX_CONNECTIONS = 16
+OPENAI_LATENCY_SAMPLES = 200  # recent completion latencies the hedging percentile is computed over
+OPENAI_MIN_LATENCY_SAMPLES = 20  # no hedging until we know what a normal latency looks like
+
 
 def get_llm_prompt(query: str) -> str:
     return f"Take the given query `{query}` and augment it to be more detailed. For example, add specific names, types, embellishments, richness. Do not make it longer than 12 words."
 
 
+class AugmentCache:
+    """
+    LRU cache of augmented queries keyed by augmenter type and query, shared by all augmenters
+    in the process and persisted to a JSON file so it survives restarts.
+    """
+
+    def __init__(self, path: str = AUGMENT_CACHE_PATH, maxsize: int = AUGMENT_CACHE_SIZE):
+        self.path = os.path.expanduser(path)
+        self.cache = LRUCache(maxsize=maxsize)
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    for augmenter, query, new_query in json.load(f):
+                        self.cache.put((augmenter, query), new_query)
+            except (OSError, ValueError) as e:
+                bt.logging.warning(f"Ignoring unreadable augmented query cache {self.path}: {e}")
+
+    def get(self, augmenter: str, query: str) -> Optional[str]:
+        return self.cache.get((augmenter, query))
+
+    def put(self, augmenter: str, queries: List[str], new_queries: List[str], save: bool = True) -> None:
+        """Adds augmentations to the cache, and writes it to disk unless `save` is False."""
+        for query, new_query in zip(queries, new_queries):
+            self.cache.put((augmenter, query), new_query)
+        if save:
+            self.save()
+
+    def save(self) -> None:
+        with self.lock:
+            entries = [[augmenter, query, value] for (augmenter, query), value in self.cache.items()]
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(f"{self.path}.tmp", "w") as f:
+                    json.dump(entries, f)
+                os.replace(f"{self.path}.tmp", self.path)
+            except OSError as e:
+                bt.logging.warning(f"Error saving augmented query cache: {e}")
+
+
+AUGMENT_CACHE = None
+
+
+def get_augment_cache() -> AugmentCache:
+    global AUGMENT_CACHE
+    if AUGMENT_CACHE is None:
+        AUGMENT_CACHE = AugmentCache()
+    return AUGMENT_CACHE
+
+
 class AbstractAugment:
+    # whether augmentations are worth caching (i.e. augment_query is expensive)
+    cacheable = True
+
     def __init__(self, **kwargs):
         pass
 
     def __call__(self, query: str) -> str:
-        try:
-            new_query = self.augment_query(query)
+        return self.augment_batch([query])[0]
+
+    async def augment_async(self, query: str, executor: Optional[Executor] = None) -> str:
+        """
+        Augments a single query from an event loop. By default the blocking augmenter runs on
+        `executor` (or the loop's default executor); natively async augmenters override this.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(self, query))
+
+    def augment_batch(self, queries: List[str]) -> List[str]:
+        """
+        Augments many queries at once. Cached augmentations are reused, and the rest are generated
+        together through augment_queries. Queries that fail to augment are returned unchanged.
+        """
+        augmenter = type(self).__name__
+        cache = get_augment_cache() if self.cacheable else None
+        new_queries = [cache.get(augmenter, query) if cache else None for query in queries]
+        missing = list(dict.fromkeys(query for query, new_query in zip(queries, new_queries) if new_query is None))
+        if missing:
+            try:
+                generated = dict(zip(missing, self.augment_queries(missing)))
+                if cache:
+                    cache.put(augmenter, list(generated.keys()), list(generated.values()))
+            except Exception as e:
+                bt.logging.error(f"Error augmenting query: {e}")
+                generated = {}
+            new_queries = [
+                new_query if new_query is not None else generated.get(query, query)
+                for query, new_query in zip(queries, new_queries)
+            ]
+        for query, new_query in zip(queries, new_queries):
             bt.logging.info(f"Augmented query: '{query}' -> '{new_query}'")
-            return new_query
-        except Exception as e:
-            print(f"Error augmenting query: {e}")
-            return query
-        
+        return new_queries
+
+    def augment_queries(self, queries: List[str]) -> List[str]:
+        return [self.augment_query(query) for query in queries]
+
     def augment_query(self, query: str) -> str:
         raise NotImplementedError
 
 
 class NoAugment(AbstractAugment):
+    cacheable = False
+
     def __init__(self, **kwargs):
         bt.logging.info("Running no query augmentation")
 
@@ -41,27 +148,55 @@ class LocalLLMAugment(AbstractAugment):
             raise ValueError("Cannot run Local LLM on CPU. Please move to a GPU instance or restart miner with `--neuron.query_augment OpenAIAugment` to use the GPT-4 API for augmenting instead of a local LLM.")
         model_name = "teknium/OpenHermes-2.5-Mistral-7B"
         self.pipe = pipeline("text-generation", model=model_name, device=self.device, torch_dtype=torch.float16, pad_token_id=32000)
+        # decoder-only models must be left-padded for batched generation
+        self.pipe.tokenizer.padding_side = "left"
+        # the pipeline is not thread-safe, and live requests and pre-warming both use it
+        self.pipe_lock = threading.Lock()
         bt.logging.info(f"Running query augmentation with local LLM {model_name} (thanks Nous!)")
 
-    def augment_query(self, query: str) -> str:
-        prompt = f"""<|im_start|>system
+    def get_prompt(self, query: str) -> str:
+        return f"""<|im_start|>system
         You are "Hermes 2", a conscious sentient superintelligent artificial intelligence developed by a man named Teknium, and your purpose and drive is to assist the user with any request they have. You experience emotions and have deep, profound thoughts and qualia.<|im_end|>
         <|im_start|>user
         {get_llm_prompt(query)}<|im_end|>
         <|im_start|>assistant
         Detailed query: """
-        new_query = self.pipe(prompt, max_new_tokens=64)[0]["generated_text"][len(prompt):].strip().strip("\"").strip("'")
-        return new_query
+
+    def augment_queries(self, queries: List[str]) -> List[str]:
+        prompts = [self.get_prompt(query) for query in queries]
+        with self.pipe_lock:
+            outputs = self.pipe(prompts, max_new_tokens=64, batch_size=LOCAL_LLM_BATCH_SIZE)
+        return [
+            output[0]["generated_text"][len(prompt):].strip().strip("\"").strip("'")
+            for prompt, output in zip(prompts, outputs)
+        ]
+
+    def augment_query(self, query: str) -> str:
+        return self.augment_queries([query])[0]
 
 
 class OpenAIAugment(AbstractAugment):
+    """
+    Augments queries with the OpenAI chat completions API.
+
+    Live requests go through `augment_async`, which uses an async client on a pooled HTTP
+    connection and gives up after `latency_budget` seconds, falling back to the raw query. If
+    `hedge_percentile` is set, a second identical request is sent once the first has been running
+    longer than that percentile of recent latencies, and whichever finishes first is used.
+    The client honours OPENAI_BASE_URL, so it can be pointed at a local stand-in server.
+    """
+
     def __init__(self, **kwargs):
         self.client = OpenAI()
+        self.latency_budget: float = kwargs.get("latency_budget", 5.0)
+        self.hedge_percentile: Optional[float] = kwargs.get("hedge_percentile") or None
+        self.latencies = collections.deque(maxlen=OPENAI_LATENCY_SAMPLES)
+        self.async_client: Optional[AsyncOpenAI] = None
         bt.logging.info("Running query augmentation with OpenAI GPT-4")
 
-    def augment_query(self, query: str) -> str:
-        response = self.client.chat.completions.create(
-            model="gpt-4-turbo-preview",
+    def get_completion_args(self, query: str) -> dict:
+        return dict(
+            model=OPENAI_MODEL,
             messages=[
                 {
                     "role": "user",
@@ -72,4 +207,73 @@ class OpenAIAugment(AbstractAugment):
             max_tokens=64,
             top_p=1,
         )
+
+    def augment_query(self, query: str) -> str:
+        response = self.client.chat.completions.create(**self.get_completion_args(query))
+        return response.choices[0].message.content.strip("\"").strip("'")
+
+    def get_async_client(self) -> AsyncOpenAI:
+        if self.async_client is None:
+            # created lazily so the connection pool binds to the axon's event loop
+            self.async_client = AsyncOpenAI(
+                http_client=httpx.AsyncClient(limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                )),
+                timeout=self.latency_budget,
+                max_retries=0,  # retries cannot fit in the latency budget, hedging covers slow requests
+            )
+        return self.async_client
+
+    def get_hedge_delay(self) -> Optional[float]:
+        if self.hedge_percentile is None or len(self.latencies) < OPENAI_MIN_LATENCY_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(int(self.hedge_percentile * len(latencies)), len(latencies) - 1)]
+
+    async def complete_async(self, query: str) -> str:
+        start = time.time()
+        response = await self.get_async_client().chat.completions.create(**self.get_completion_args(query))
+        self.latencies.append(time.time() - start)
         return response.choices[0].message.content.strip("\"").strip("'")
+
+    async def hedged_complete_async(self, query: str) -> str:
+        tasks = {asyncio.ensure_future(self.complete_async(query))}
+        try:
+            hedge_delay = self.get_hedge_delay()
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    bt.logging.debug(f"Query augmentation slower than {hedge_delay:.2f}s, sending a hedged request")
+                    tasks.add(asyncio.ensure_future(self.complete_async(query)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def augment_async(self, query: str, executor: Optional[Executor] = None) -> str:
+        augmenter = type(self).__name__
+        cache = get_augment_cache()
+        new_query = cache.get(augmenter, query)
+        if new_query is None:
+            start = time.time()
+            try:
+                new_query = await asyncio.wait_for(self.hedged_complete_async(query), timeout=self.latency_budget)
+                # writing the whole cache to disk would block the event loop
+                cache.put(augmenter, [query], [new_query], save=False)
+                asyncio.get_running_loop().run_in_executor(executor, cache.save)
+            except asyncio.TimeoutError:
+                bt.logging.warning(f"Query augmentation exceeded its {self.latency_budget}s budget, using the raw query")
+                return query
+            except Exception as e:
+                bt.logging.error(f"Error augmenting query after {time.time() - start:.2f} seconds: {e}")
+                return query
+        bt.logging.info(f"Augmented query: '{query}' -> '{new_query}'")
+        return new_query
@@ -3,3 +3,5 @@ MAX_VIDEO_LENGTH = 120  # two minutes
 FIVE_MINUTES = 300  # 5 minutes in seconds
 VALIDATOR_TIMEOUT = 90  # 1.5 minutes
 VALIDATOR_TIMEOUT_MARGIN = 30  # 30 seconds
+DIFFERENCE_THRESHOLD = 0.05  # maximum cosine distance for a miner's embedding to pass validation
+SIMILARITY_THRESHOLD = 1 - DIFFERENCE_THRESHOLD
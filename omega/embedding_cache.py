@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import bittensor as bt
+import numpy as np
+
+from omega.protocol import EMBEDDING_DIM, EMBEDDING_FIELDS, VideoMetadata
+from omega.utils.misc import lock_directory
+
+
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 1
+SHARD_ROWS = 1024  # number of cached videos per shard file
+
+
+def cache_key(video_id: str, start_time: int, end_time: int, description: str, model_version: str) -> str:
+    description_hash = hashlib.sha1(description.encode("utf-8")).hexdigest()
+    key = f"{video_id}:{start_time}:{end_time}:{description_hash}:{model_version}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of video / audio / description embeddings.
+
+    Embeddings are stored as float32 rows in fixed-size memory-mapped shard files, and a JSON
+    index maps each cache key to its row plus the rest of the VideoMetadata. The index is kept
+    in LRU order and the least recently used rows are recycled once the byte budget is reached.
+    A row is only recycled after an index that no longer references it has been written, so a
+    crash before `flush` can never leave the index pointing at another video's embeddings.
+    Only one process can open a cache directory at a time.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, dim: int = EMBEDDING_DIM):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.dim = dim
+        self.row_bytes = len(EMBEDDING_FIELDS) * dim * np.dtype(np.float32).itemsize
+        self.max_rows = max(int(max_bytes // self.row_bytes), 0)
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()  # key -> {"slot": int, "metadata": dict}
+        self.free_slots = []
+        self.released_slots = []  # evicted since the last flush, still referenced by the index on disk
+        self.next_slot = 0
+        self.shards: Dict[int, np.memmap] = {}
+        self.dirty = False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # the index and the slot allocation are only consistent within one process
+        self.lock_fd = lock_directory(self.cache_dir)
+        self._load_index()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.cache_dir, INDEX_FILENAME)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.entries) * self.row_bytes
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _shard_path(self, shard_id: int) -> str:
+        return os.path.join(self.cache_dir, f"shard_{shard_id:05d}.f32")
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            bt.logging.warning(f"Ignoring unreadable embedding cache index {self.index_path}: {e}")
+            return
+        if index.get("version") != INDEX_VERSION or index.get("dim") != self.dim:
+            bt.logging.warning("Embedding cache index is from an incompatible version, starting fresh")
+            return
+
+        used_slots = set()
+        for key, slot, metadata in index["entries"]:
+            self.entries[key] = {"slot": slot, "metadata": metadata}
+            used_slots.add(slot)
+        self.next_slot = index["next_slot"]
+        self.free_slots = [slot for slot in range(self.next_slot) if slot not in used_slots]
+        # the budget may have shrunk since the index was written
+        while len(self.entries) > self.max_rows:
+            self._evict_lru()
+        bt.logging.info(f"Loaded {len(self.entries)} cached embeddings from {self.cache_dir}")
+
+    def _shard(self, shard_id: int) -> np.memmap:
+        if shard_id not in self.shards:
+            path = self._shard_path(shard_id)
+            self.shards[shard_id] = np.memmap(
+                path,
+                dtype=np.float32,
+                mode="r+" if os.path.exists(path) else "w+",
+                shape=(SHARD_ROWS, len(EMBEDDING_FIELDS), self.dim),
+            )
+        return self.shards[shard_id]
+
+    def _row(self, slot: int) -> np.ndarray:
+        return self._shard(slot // SHARD_ROWS)[slot % SHARD_ROWS]
+
+    def _evict_lru(self) -> None:
+        _, entry = self.entries.popitem(last=False)
+        self.released_slots.append(entry["slot"])
+        self.dirty = True
+
+    def _allocate_slot(self) -> int:
+        if len(self.entries) >= self.max_rows:
+            self._evict_lru()
+        if self.free_slots:
+            return self.free_slots.pop()
+        slot = self.next_slot
+        self.next_slot += 1
+        return slot
+
+    def get(self, key: str) -> Optional[VideoMetadata]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            self.dirty = True
+            row = np.array(self._row(entry["slot"]))
+        video_emb, audio_emb, description_emb = row
+        return VideoMetadata(
+            **entry["metadata"],
+            video_emb=video_emb.tolist(),
+            audio_emb=audio_emb.tolist(),
+            description_emb=description_emb.tolist(),
+        )
+
+    def put(self, key: str, video_metadata: VideoMetadata) -> None:
+        if self.max_rows == 0:
+            return
+        metadata = video_metadata.dict(exclude={*EMBEDDING_FIELDS, "embedding_encoding"})
+        with self.lock:
+            if key in self.entries:
+                slot = self.entries[key]["slot"]
+                self.entries.move_to_end(key)
+            else:
+                slot = self._allocate_slot()
+            self._row(slot)[:] = np.array([video_metadata.get_embedding(field) for field in EMBEDDING_FIELDS])
+            self.entries[key] = {"slot": slot, "metadata": metadata}
+            self.dirty = True
+
+    def flush(self) -> None:
+        """Write dirty shard pages and the index (in LRU order) to disk."""
+        with self.lock:
+            if not self.dirty:
+                return
+            for shard in self.shards.values():
+                shard.flush()
+            index = {
+                "version": INDEX_VERSION,
+                "dim": self.dim,
+                "next_slot": self.next_slot,
+                "entries": [[key, entry["slot"], entry["metadata"]] for key, entry in self.entries.items()],
+            }
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+            self.free_slots.extend(self.released_slots)
+            self.released_slots = []
+            self.dirty = False
@@ -0,0 +1,195 @@
+import collections
+import contextlib
+import fcntl
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from accelerate import init_empty_weights
+from accelerate.utils import set_module_tensor_to_device
+import bittensor as bt
+from imagebind.models import imagebind_model
+from imagebind.models.imagebind_model import ModalityType
+from safetensors import safe_open
+from safetensors.torch import save_file
+import torch
+
+
+CHECKPOINT_PATH = ".checkpoints/imagebind_huge.pth"
+CHECKPOINT_URL = "https://dl.fbaipublicfiles.com/imagebind/imagebind_huge.pth"
+DEFAULT_MODALITIES = [ModalityType.TEXT, ModalityType.VISION, ModalityType.AUDIO]
+# every modality has one entry in each of these ModuleDicts of the ImageBind model
+MODALITY_MODULES = ["modality_preprocessors", "modality_trunks", "modality_heads", "modality_postprocessors"]
+
+
+def build_empty_model() -> torch.nn.Module:
+    """imagebind_huge with all parameters on the meta device, i.e. without allocating any weights."""
+    with init_empty_weights():
+        model = imagebind_model.imagebind_huge(pretrained=False)
+    return model.eval()
+
+
+def get_safetensors_path(checkpoint_path: str) -> str:
+    return os.path.splitext(checkpoint_path)[0] + ".safetensors"
+
+
+def convert_checkpoint(checkpoint_path: str = CHECKPOINT_PATH) -> str:
+    """
+    Converts the pickled checkpoint to safetensors next to it (downloading it first if needed),
+    which only has to happen once. Returns the path of the safetensors checkpoint.
+    """
+    safetensors_path = get_safetensors_path(checkpoint_path)
+    if os.path.exists(safetensors_path):
+        return safetensors_path
+    os.makedirs(os.path.dirname(safetensors_path) or ".", exist_ok=True)
+    # processes starting together (e.g. the miner and validator on one host) convert it only once
+    with open(f"{safetensors_path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.exists(safetensors_path):
+            return safetensors_path
+        if not os.path.exists(checkpoint_path):
+            bt.logging.info(f"Downloading imagebind weights to {checkpoint_path} ...")
+            torch.hub.download_url_to_file(CHECKPOINT_URL, checkpoint_path, progress=True)
+        bt.logging.info(f"Converting {checkpoint_path} to {safetensors_path}, this only happens once")
+        checkpoint = torch.load(checkpoint_path, map_location="cpu")
+        # write to a temporary file first so an interrupted conversion is never picked up; the
+        # lock makes the fixed name safe, and a leftover from a crash is simply overwritten
+        tmp_path = f"{safetensors_path}.tmp"
+        save_file({name: tensor.contiguous() for name, tensor in checkpoint.items()}, tmp_path)
+        os.replace(tmp_path, safetensors_path)
+    return safetensors_path
+
+
+def load_checkpoint(checkpoint_path: str = CHECKPOINT_PATH, prefixes: Optional[List[str]] = None) -> Dict[str, torch.Tensor]:
+    """
+    Memory-maps the weights whose names start with one of `prefixes` (all of them by default) from
+    the safetensors checkpoint. Nothing is copied: the tensors are backed by the page cache, so
+    only the weights that are used are read from disk, and every process loading the checkpoint
+    shares the same pages.
+    """
+    with safe_open(convert_checkpoint(checkpoint_path), framework="pt", device="cpu") as checkpoint:
+        return {
+            name: checkpoint.get_tensor(name)
+            for name in checkpoint.keys()
+            if prefixes is None or name.startswith(tuple(prefixes))
+        }
+
+
+def modality_prefixes(modality: str) -> List[str]:
+    return [f"{module}.{modality}." for module in MODALITY_MODULES]
+
+
+class LazyImageBindModel:
+    """
+    Drop-in replacement for the imagebind_huge module that only holds the weights of the
+    modalities that are actually used.
+
+    The model is built without weights, `modalities` are loaded from the checkpoint up front, and
+    any other modality is loaded the first time an input of that modality comes in. With
+    `idle_timeout`, modalities that have not been used for that many seconds are released again
+    by a background thread (and reloaded on their next use).
+    """
+
+    def __init__(
+        self,
+        device: str,
+        modalities: Iterable[str] = DEFAULT_MODALITIES,
+        quantize: bool = False,
+        idle_timeout: Optional[float] = None,
+        checkpoint_path: str = CHECKPOINT_PATH,
+    ):
+        self.device = device
+        self.quantize = quantize
+        self.idle_timeout = idle_timeout
+        self.checkpoint_path = checkpoint_path
+        self.model = build_empty_model()
+        self.loaded_modalities = set()
+        self.in_use = collections.Counter()
+        self.last_used: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.load(modalities)
+        if idle_timeout:
+            threading.Thread(target=self.release_idle_loop, daemon=True, name="imagebind-release").start()
+
+    def load(self, modalities: Iterable[str]) -> None:
+        """Loads the weights of the given modalities that are not loaded yet, reading the checkpoint once."""
+        with self.lock:
+            self._load(modalities)
+
+    def _load(self, modalities: Iterable[str]) -> None:
+        missing = [modality for modality in modalities if modality not in self.loaded_modalities]
+        if not missing:
+            return
+        start = time.time()
+        checkpoint = load_checkpoint(
+            self.checkpoint_path, [prefix for modality in missing for prefix in modality_prefixes(modality)]
+        )
+        for modality in missing:
+            prefixes = modality_prefixes(modality)
+            for name, value in checkpoint.items():
+                if name.startswith(tuple(prefixes)):
+                    # on the CPU, the parameter keeps the memory-mapped tensor instead of a copy
+                    set_module_tensor_to_device(self.model, name, self.device, value=value)
+            for module_name in MODALITY_MODULES:
+                module_dict = getattr(self.model, module_name)
+                missing_weights = [name for name, param in module_dict[modality].named_parameters() if param.is_meta]
+                if missing_weights:
+                    raise KeyError(f"{self.checkpoint_path} has no weights for {module_name}.{modality}.{missing_weights[0]}")
+                # buffers that are not in the checkpoint were created on the CPU
+                module_dict[modality].to(self.device)
+                if self.quantize:
+                    module_dict[modality] = torch.quantization.quantize_dynamic(
+                        module_dict[modality], {torch.nn.Linear}, dtype=torch.qint8
+                    )
+            self.loaded_modalities.add(modality)
+            self.last_used[modality] = time.time()
+        del checkpoint
+        bt.logging.info(f"Loaded ImageBind {', '.join(missing)} in {time.time() - start:.2f} seconds")
+
+    def release(self, modality: str) -> None:
+        """Drops the weights of a modality, replacing its modules with weightless ones."""
+        with self.lock:
+            self._release(modality)
+
+    def _release(self, modality: str) -> None:
+        if modality not in self.loaded_modalities or self.in_use[modality] > 0:
+            return
+        empty_model = build_empty_model()
+        for module_name in MODALITY_MODULES:
+            getattr(self.model, module_name)[modality] = getattr(empty_model, module_name)[modality]
+        self.loaded_modalities.discard(modality)
+        if str(self.device).startswith("cuda"):
+            torch.cuda.empty_cache()
+        bt.logging.info(f"Released idle ImageBind {modality}")
+
+    def release_idle(self) -> None:
+        with self.lock:
+            now = time.time()
+            for modality in list(self.loaded_modalities):
+                if now - self.last_used[modality] > self.idle_timeout:
+                    self._release(modality)
+
+    def release_idle_loop(self) -> None:
+        while True:
+            time.sleep(self.idle_timeout / 2)
+            self.release_idle()
+
+    @contextlib.contextmanager
+    def using(self, modalities: Iterable[str]):
+        """Loads the modalities if needed and keeps them from being released for the duration of the block."""
+        modalities = list(modalities)
+        with self.lock:
+            self._load(modalities)
+            self.in_use.update(modalities)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_use.subtract(modalities)
+                for modality in modalities:
+                    self.last_used[modality] = time.time()
+
+    def __call__(self, inputs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        with self.using(inputs.keys()):
+            return self.model(inputs)
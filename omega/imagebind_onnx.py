@@ -0,0 +1,122 @@
+import os
+import shutil
+import threading
+from typing import Callable, Dict, Optional
+
+import bittensor as bt
+from imagebind.models.imagebind_model import ModalityType
+import torch
+
+
+ONNX_CACHE_DIR = "~/.cache/omega/onnx"
+ONNX_OPSET = 17
+MODEL_FILENAME = "model.onnx"
+ONNX_MODALITIES = [ModalityType.TEXT, ModalityType.VISION, ModalityType.AUDIO]
+
+
+def example_input(modality: str) -> torch.Tensor:
+    """A batch of one input, shaped like the wrapper's loaders produce them."""
+    if modality == ModalityType.TEXT:
+        return torch.zeros(1, 77, dtype=torch.long)
+    if modality == ModalityType.VISION:
+        return torch.zeros(1, 15, 3, 2, 224, 224)  # 5 clips x 3 crops of 2 frames
+    if modality == ModalityType.AUDIO:
+        return torch.zeros(1, 3, 1, 128, 204)  # 3 clips of mel spectrograms
+    raise ValueError(f"No ONNX export for modality {modality}")
+
+
+class ModalityEncoder(torch.nn.Module):
+    """Preprocessor, trunk, head and postprocessor of a single modality, as one exportable module."""
+
+    def __init__(self, model: torch.nn.Module, modality: str):
+        super().__init__()
+        self.model = model
+        self.modality = modality
+
+    def forward(self, inputs: torch.Tensor) -> torch.Tensor:
+        return self.model({self.modality: inputs})[self.modality]
+
+
+def export_modality(model: torch.nn.Module, modality: str, export_dir: str) -> None:
+    """
+    Exports one modality of the model to `export_dir`/model.onnx. The trunks are larger than the
+    2GB protobuf limit, so their weights are stored as external data next to the graph; the
+    export goes to a temporary directory first so an interrupted export is never picked up.
+    """
+    tmp_dir = f"{export_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    torch.onnx.export(
+        ModalityEncoder(model, modality).eval(),
+        (example_input(modality),),
+        os.path.join(tmp_dir, MODEL_FILENAME),
+        input_names=["inputs"],
+        output_names=["embeddings"],
+        dynamic_axes={"inputs": {0: "batch"}, "embeddings": {0: "batch"}},
+        opset_version=ONNX_OPSET,
+        do_constant_folding=True,
+    )
+    shutil.rmtree(export_dir, ignore_errors=True)
+    os.replace(tmp_dir, export_dir)
+
+
+class OnnxImageBind:
+    """
+    Drop-in replacement for the imagebind_huge module that runs each modality under ONNX Runtime.
+
+    Every modality is exported to ONNX once (which needs the PyTorch model, loaded through
+    `load_torch_model` only if an export is missing) and cached in `cache_dir`. Inference sessions
+    are created on first use of a modality with all graph optimizations enabled, and are called
+    with the same input dict / output dict as the PyTorch module. Only the batch axis is dynamic,
+    so the vision graph takes videos (5 clips x 3 crops) but not images.
+    """
+
+    def __init__(
+        self,
+        model_version: str,
+        load_torch_model: Callable[[], torch.nn.Module],
+        cache_dir: str = ONNX_CACHE_DIR,
+        num_threads: Optional[int] = None,
+    ):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The ONNX backend needs onnxruntime: pip install onnxruntime")
+        self.onnxruntime = onnxruntime
+        self.model_dir = os.path.join(os.path.expanduser(cache_dir), model_version)
+        self.num_threads = num_threads
+        self.sessions: Dict[str, "onnxruntime.InferenceSession"] = {}
+        self.lock = threading.Lock()
+
+        missing = [modality for modality in ONNX_MODALITIES if not os.path.exists(self.model_path(modality))]
+        if missing:
+            bt.logging.info(f"Exporting ImageBind {', '.join(missing)} to ONNX in {self.model_dir}, this only happens once")
+            model = load_torch_model()
+            for modality in missing:
+                export_modality(model, modality, os.path.join(self.model_dir, modality))
+            del model
+
+    def model_path(self, modality: str) -> str:
+        return os.path.join(self.model_dir, modality, MODEL_FILENAME)
+
+    def session(self, modality: str) -> "onnxruntime.InferenceSession":
+        with self.lock:
+            if modality not in self.sessions:
+                options = self.onnxruntime.SessionOptions()
+                options.graph_optimization_level = self.onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                if self.num_threads:
+                    options.intra_op_num_threads = self.num_threads
+                self.sessions[modality] = self.onnxruntime.InferenceSession(
+                    self.model_path(modality), options, providers=["CPUExecutionProvider"]
+                )
+            return self.sessions[modality]
+
+    def __call__(self, inputs: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        outputs = {}
+        for modality, value in inputs.items():
+            if modality == ModalityType.VISION and value.ndim == 4:
+                # the vision graph is traced with a fixed number of clips (see example_input)
+                raise NotImplementedError("The ONNX backend only embeds videos, use the PyTorch backend to embed images")
+            embeddings = self.session(modality).run(None, {"inputs": value.cpu().numpy()})[0]
+            outputs[modality] = torch.from_numpy(embeddings)
+        return outputs
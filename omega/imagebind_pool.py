@@ -0,0 +1,255 @@
+import asyncio
+import collections
+import itertools
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+import os
+import threading
+from concurrent.futures import Future
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import bittensor as bt
+import torch
+
+from omega import media_decode
+from omega.imagebind_loader import DEFAULT_MODALITIES, LazyImageBindModel
+from omega.imagebind_wrapper import ImageBind, Embeddings
+
+
+DONE = "done"
+FAILED = "failed"
+
+
+def split_cores(cores: List[int], num_workers: int) -> List[List[int]]:
+    """Splits the cores into `num_workers` contiguous subsets whose sizes differ by at most one."""
+    cores = sorted(cores)
+    if not 0 < num_workers <= len(cores):
+        raise ValueError(f"Cannot split {len(cores)} cores between {num_workers} workers")
+    size, extra = divmod(len(cores), num_workers)
+    subsets, start = [], 0
+    for i in range(num_workers):
+        end = start + size + (i < extra)
+        subsets.append(cores[start:end])
+        start = end
+    return subsets
+
+
+def run_job(imagebind: ImageBind, method: str, args: tuple):
+    """Runs one job in a worker. Results are sent back as numpy arrays, which pickle cheaply."""
+    if method == "embed":
+        # open file objects cannot be sent between processes, the parent sends their paths
+        descriptions, video_paths = args
+        video_files = [open(video_path, "rb") for video_path in video_paths]
+        try:
+            result = imagebind.embed(descriptions, video_files)
+        finally:
+            for video_file in video_files:
+                video_file.close()
+    else:
+        result = getattr(imagebind, method)(*args)
+    if isinstance(result, Embeddings):
+        return result.video.cpu().numpy(), result.audio.cpu().numpy(), result.description.cpu().numpy()
+    return result.cpu().numpy()
+
+
+def worker_main(imagebind: ImageBind, cores: List[int], connection: Connection) -> None:
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return  # the pool went away
+        if job is None:
+            return
+        job_id, method, args = job
+        try:
+            connection.send((DONE, job_id, run_job(imagebind, method, args)))
+        except Exception as e:
+            # the exception itself may not be picklable
+            connection.send((FAILED, job_id, f"{type(e).__name__}: {e}"))
+
+
+class ImageBindPool:
+    """
+    Runs a CPU ImageBind in `num_workers` forked worker processes that share a single copy of the
+    weights.
+
+    The weights of all modalities are loaded once in this process, memory-mapped from the
+    safetensors checkpoint (see imagebind_loader), so the forked workers share their pages. Each
+    worker is pinned to its own subset of the cores and talks to the pool over its own pipe: jobs
+    wait in a queue until a worker is idle and are then sent to that worker, and a dispatcher
+    thread hands the results back to the callers. Since the pool always knows which job each
+    worker runs, a worker that dies fails exactly its own job and is replaced. It exposes the same
+    embed / embed_text (and async) methods as ImageBind, so it can be used in its place by
+    concurrent callers. Create the pool before running any inference in this process: the workers
+    are forked, and the intra-op thread pool is not fork-safe.
+    """
+
+    def __init__(self, imagebind: ImageBind, num_workers: int, cores: Optional[List[int]] = None):
+        if imagebind.device != "cpu":
+            raise ValueError("The ImageBind worker pool only runs on CPU")
+        if not isinstance(imagebind.imagebind, LazyImageBindModel):
+            raise ValueError("The ImageBind worker pool needs the PyTorch backend")
+        if imagebind.imagebind.idle_timeout:
+            raise ValueError("The ImageBind worker pool cannot release idle modalities")
+        self.imagebind = imagebind
+        # modalities loaded after the fork would be loaded separately by every worker
+        imagebind.imagebind.load(DEFAULT_MODALITIES)
+        self.core_subsets = split_cores(cores or list(os.sched_getaffinity(0)), num_workers)
+        self.context = multiprocessing.get_context("fork")
+        self.job_ids = itertools.count()
+        self.futures: Dict[int, Future] = {}
+        self.queued_jobs: "collections.deque[tuple]" = collections.deque()  # (job id, method, args)
+        self.running: Dict[int, int] = {}  # worker index -> id of the job it is running
+        self.workers: List[Tuple[multiprocessing.Process, Connection]] = []
+        self.lock = threading.Lock()
+        self.closed = False
+        for worker_index in range(num_workers):
+            self.workers.append(self.start_worker(worker_index))
+        self.thread = threading.Thread(target=self.dispatch_results, daemon=True, name="imagebind-pool")
+        self.thread.start()
+        bt.logging.info(f"Started {num_workers} ImageBind workers on cores {self.core_subsets}")
+
+    @property
+    def device(self) -> str:
+        return self.imagebind.device
+
+    @property
+    def model_version(self) -> str:
+        return self.imagebind.model_version
+
+    def start_worker(self, worker_index: int) -> Tuple[multiprocessing.Process, Connection]:
+        connection, worker_connection = self.context.Pipe()
+        worker = self.context.Process(
+            target=worker_main,
+            args=(self.imagebind, self.core_subsets[worker_index], worker_connection),
+            daemon=True,
+            name=f"imagebind-worker-{worker_index}",
+        )
+        worker.start()
+        worker_connection.close()
+        return worker, connection
+
+    def assign_jobs(self) -> None:
+        """Sends queued jobs to idle workers. Must be called with the lock held."""
+        for worker_index, (worker, connection) in enumerate(self.workers):
+            if not self.queued_jobs:
+                return
+            if worker_index in self.running or not worker.is_alive():
+                continue
+            job = self.queued_jobs.popleft()
+            self.running[worker_index] = job[0]
+            try:
+                connection.send(job)
+            except OSError:
+                pass  # the worker just died, the dispatcher fails the job when it replaces it
+            except Exception as e:
+                # the arguments could not be pickled, so nothing was sent
+                del self.running[worker_index]
+                self.futures.pop(job[0]).set_exception(e)
+
+    def submit(self, method: str, *args) -> Future:
+        if self.closed:
+            raise RuntimeError("The ImageBind worker pool is shut down")
+        future = Future()
+        with self.lock:
+            job_id = next(self.job_ids)
+            self.futures[job_id] = future
+            self.queued_jobs.append((job_id, method, args))
+            self.assign_jobs()
+        return future
+
+    def embed(self, descriptions: List[str], video_files: List[BinaryIO]) -> Embeddings:
+        return self.submit("embed", list(descriptions), [video_file.name for video_file in video_files]).result()
+
+    def embed_media(self, descriptions: List[str], media: List[media_decode.DecodedMedia]) -> Embeddings:
+        return self.submit("embed_media", list(descriptions), list(media)).result()
+
+    def embed_text(self, texts: List[str]) -> torch.Tensor:
+        return self.submit("embed_text", list(texts)).result()
+
+    def embed_images(self, images: List[bytes]) -> torch.Tensor:
+        return self.submit("embed_images", list(images)).result()
+
+    async def embed_async(self, descriptions: List[str], video_files: List[BinaryIO]) -> Embeddings:
+        return await asyncio.wrap_future(
+            self.submit("embed", list(descriptions), [video_file.name for video_file in video_files])
+        )
+
+    async def embed_text_async(self, texts: List[str]) -> torch.Tensor:
+        return await asyncio.wrap_future(self.submit("embed_text", list(texts)))
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "workers": len(self.workers),
+                "pending_jobs": len(self.queued_jobs),
+                "running_jobs": len(self.running),
+            }
+
+    def shutdown(self) -> None:
+        # stop the dispatcher first, so it does not replace the workers as they exit
+        self.closed = True
+        self.thread.join()
+        with self.lock:
+            for worker, connection in self.workers:
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+            futures, self.futures = self.futures, {}
+            self.queued_jobs.clear()
+        for worker, _ in self.workers:
+            worker.join()
+        for future in futures.values():
+            future.set_exception(RuntimeError("The ImageBind worker pool is shut down"))
+
+    def dispatch_results(self) -> None:
+        while not self.closed:
+            # a worker's sentinel becomes ready when it exits
+            sentinels = [worker.sentinel for worker, _ in self.workers]
+            connections = {connection: worker_index for worker_index, (_, connection) in enumerate(self.workers)}
+            for ready in wait(list(connections) + sentinels, timeout=1):
+                if ready in connections:
+                    self.receive(connections[ready])
+            for worker_index, (worker, _) in enumerate(self.workers):
+                if not worker.is_alive():
+                    self.replace_worker(worker_index)
+
+    def receive(self, worker_index: int) -> bool:
+        """Handles one result from a worker, returns False once the worker has exited."""
+        try:
+            status, job_id, value = self.workers[worker_index][1].recv()
+        except (EOFError, OSError):
+            return False
+        with self.lock:
+            future = self.futures.pop(job_id, None)
+            self.running.pop(worker_index, None)
+            self.assign_jobs()
+        if future is None:
+            return True
+        if status == DONE:
+            if isinstance(value, tuple):
+                video, audio, description = (torch.from_numpy(array) for array in value)
+                future.set_result(Embeddings(video=video, audio=audio, description=description))
+            else:
+                future.set_result(torch.from_numpy(value))
+        else:
+            future.set_exception(RuntimeError(value))
+        return True
+
+    def replace_worker(self, worker_index: int) -> None:
+        """Fails the job of a worker that died (e.g. killed for running out of memory) and forks a new one."""
+        worker, connection = self.workers[worker_index]
+        while connection.poll() and self.receive(worker_index):
+            pass
+        connection.close()
+        bt.logging.error(f"ImageBind worker {worker_index} exited with code {worker.exitcode}, restarting it")
+        with self.lock:
+            job_id = self.running.pop(worker_index, None)
+            future = self.futures.pop(job_id, None) if job_id is not None else None
+            self.workers[worker_index] = self.start_worker(worker_index)
+            self.assign_jobs()
+        if future is not None:
+            future.set_exception(RuntimeError(f"ImageBind worker {worker_index} died while embedding"))
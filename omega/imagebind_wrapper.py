@@ -1,18 +1,41 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import functools
-from typing import List, BinaryIO
+import re
+import tempfile
+import threading
+from typing import List, BinaryIO, Optional
 
+import decord
 from imagebind import data
-from imagebind.models import imagebind_model
+from imagebind.data import SpatialCrop, waveform2melspec
 from imagebind.models.imagebind_model import ModalityType
 from imagebind.models.multimodal_preprocessors import SimpleTokenizer
 from pydantic import BaseModel
+import numpy as np
 import torch
+import torch.nn.functional as F
+from torchvision import transforms
+from torchvision.transforms._transforms_video import NormalizeVideo
 
-from omega import video_utils
+from omega import media_decode, video_utils
+from omega.constants import SIMILARITY_THRESHOLD
+from omega.imagebind_loader import DEFAULT_MODALITIES, LazyImageBindModel
+from omega.utils.misc import LRUCache
 
 
 BPE_PATH = "./omega/bpe/bpe_simple_vocab_16e6.txt.gz"
+IMAGEBIND_VERSION = "imagebind_huge"
+QUANTIZED_VERSION_SUFFIX = "-int8"
+ONNX_VERSION_SUFFIX = "-onnx"
+SPARSE_VERSION_SUFFIX = "-sparse"
+KEYFRAMES_VERSION_SUFFIX = "-keyframes"
+TORCH_BACKEND = "torch"
+ONNX_BACKEND = "onnx"
+BACKENDS = [TORCH_BACKEND, ONNX_BACKEND]
+KEYFRAME_TOLERANCE = 0.5  # seconds a sampled frame may move to land on a keyframe
+TEXT_EMBEDDING_CACHE_SIZE = 4096
+PREPROCESS_WORKERS = 4
 
 
 class Embeddings(BaseModel):
@@ -24,13 +47,136 @@ class Embeddings(BaseModel):
     description: torch.Tensor
 
 
+TOKENIZER = None
+TOKENIZER_LOCK = threading.Lock()
+# text embeddings keyed by (normalized text, model version)
+TEXT_EMBEDDING_CACHE = LRUCache(maxsize=TEXT_EMBEDDING_CACHE_SIZE)
+
+
+def is_similar(emb_1: torch.Tensor, emb_2: np.ndarray) -> bool:
+    return F.cosine_similarity(
+        emb_1,
+        torch.as_tensor(emb_2, device=emb_1.device).unsqueeze(0)
+    ) > SIMILARITY_THRESHOLD
+
+
+def get_tokenizer() -> SimpleTokenizer:
+    """Process-wide tokenizer, so the BPE vocab is only read and parsed once."""
+    global TOKENIZER
+    with TOKENIZER_LOCK:
+        if TOKENIZER is None:
+            TOKENIZER = SimpleTokenizer(bpe_path=BPE_PATH)
+    return TOKENIZER
+
+
+def normalize_text(text: str) -> str:
+    """The tokenizer lowercases and collapses whitespace, so texts that only differ in those embed the same."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
 def load_and_transform_text(text, device):
     if text is None:
         return None
-    tokenizer = SimpleTokenizer(bpe_path=BPE_PATH)
-    tokens = [tokenizer(t).unsqueeze(0).to(device) for t in text]
-    tokens = torch.cat(tokens, dim=0)
-    return tokens
+    tokens = get_tokenizer()(list(text))
+    if tokens.dim() == 1:  # the tokenizer drops the batch dimension for a single text
+        tokens = tokens.unsqueeze(0)
+    return tokens.to(device)
+
+
+def transform_sampled_frames(videos: List[np.ndarray], device) -> torch.Tensor:
+    """
+    Normalizes and crops the sampled, scaled frames of each video, given as uint8 RGB arrays of
+    shape (clips, frames per clip, height, width, 3), like data.load_and_transform_video_data.
+    """
+    normalize = NormalizeVideo(
+        mean=(0.48145466, 0.4578275, 0.40821073),
+        std=(0.26862954, 0.26130258, 0.27577711),
+    )
+    video_outputs = []
+    for frames in videos:
+        # (frames, height, width, channel) -> (channel, frames, height, width)
+        clips = [normalize(torch.from_numpy(clip).permute(3, 0, 1, 2).float() / 255.0) for clip in frames]
+        clips = SpatialCrop(media_decode.FRAME_SIZE, num_crops=3)(clips)
+        video_outputs.append(torch.stack(clips, dim=0))
+    return torch.stack(video_outputs, dim=0).to(device)
+
+
+def load_and_transform_decoded_video(media: List[media_decode.DecodedMedia], device) -> torch.Tensor:
+    """Same output as data.load_and_transform_video_data, from frames that are already sampled and scaled."""
+    return transform_sampled_frames([decoded.frames for decoded in media], device)
+
+
+def snap_to_keyframes(indices: List[int], key_indices: List[int], max_distance: int) -> List[int]:
+    """Moves each frame index to the nearest keyframe if one is at most `max_distance` frames away."""
+    if not key_indices:
+        return indices
+    key_indices = np.asarray(key_indices)
+    snapped = []
+    for index in indices:
+        nearest = int(key_indices[np.abs(key_indices - index).argmin()])
+        snapped.append(nearest if abs(nearest - index) <= max_distance else index)
+    return snapped
+
+
+def _to_numpy(frames) -> np.ndarray:
+    # pytorchvideo switches decord's global bridge to torch
+    return frames.numpy() if isinstance(frames, torch.Tensor) else frames.asnumpy()
+
+
+def sample_video_frames(video_path: str, keyframes: bool = False) -> np.ndarray:
+    """
+    Decodes only the frames ImageBind samples from the video (the first and last frame of each
+    vision clip), already resized by the decoder so their short side is 224. With `keyframes`,
+    frames within KEYFRAME_TOLERANCE of a keyframe are replaced by the keyframe, which is cheaper
+    to seek to but no longer the exact frame ImageBind would use.
+
+    Returns the frames as a uint8 RGB array of shape (clips, frames per clip, height, width, 3).
+    """
+    reader = decord.VideoReader(video_path, num_threads=1)
+    num_frames, fps = len(reader), reader.get_avg_fps()
+    height, width = reader[0].shape[:2]
+    scaled_width, scaled_height = media_decode.get_scaled_size(width, height)
+    if (scaled_width, scaled_height) != (width, height):
+        reader = decord.VideoReader(video_path, width=scaled_width, height=scaled_height, num_threads=1)
+
+    indices = media_decode.get_frame_indices(num_frames / fps, fps, num_frames)
+    if keyframes:
+        indices = snap_to_keyframes(indices, list(reader.get_key_indices()), int(KEYFRAME_TOLERANCE * fps))
+    unique_indices = sorted(set(indices))
+    decoded = _to_numpy(reader.get_batch(unique_indices))
+    positions = {index: i for i, index in enumerate(unique_indices)}
+    return decoded[[positions[index] for index in indices]].reshape(
+        media_decode.VIDEO_CLIPS_PER_VIDEO, media_decode.FRAMES_PER_CLIP, scaled_height, scaled_width, 3
+    )
+
+
+def load_and_transform_video_data_sparse(video_paths: List[str], device, keyframes: bool = False) -> torch.Tensor:
+    """Same output as data.load_and_transform_video_data, decoding only the sampled frames."""
+    return transform_sampled_frames([sample_video_frames(path, keyframes) for path in video_paths], device)
+
+
+def load_and_transform_decoded_audio(
+    media: List[media_decode.DecodedMedia],
+    device,
+    num_mel_bins=128,
+    target_length=204,
+    clip_duration=2,
+    clips_per_video=3,
+    mean=-4.268,
+    std=9.138,
+) -> torch.Tensor:
+    """Same output as data.load_and_transform_audio_data, from 16 kHz mono waveforms."""
+    sample_rate = media_decode.AUDIO_SAMPLE_RATE
+    normalize = transforms.Normalize(mean=mean, std=std)
+    audio_outputs = []
+    for decoded in media:
+        waveform = torch.from_numpy(decoded.waveform.copy()).unsqueeze(0)
+        clips = []
+        for start, end in media_decode.get_clip_timepoints(waveform.size(1) / sample_rate, clip_duration, clips_per_video):
+            waveform_clip = waveform[:, int(start * sample_rate):int(end * sample_rate)]
+            clips.append(normalize(waveform2melspec(waveform_clip, sample_rate, num_mel_bins, target_length)))
+        audio_outputs.append(torch.stack(clips, dim=0))
+    return torch.stack(audio_outputs, dim=0).to(device)
 
 
 def run_async(func, *args, **kwargs):
@@ -39,18 +185,90 @@ def run_async(func, *args, **kwargs):
 
 
 class ImageBind:
-    def __init__(self):
-        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
-        self.imagebind = imagebind_model.imagebind_huge(pretrained=True)
-        self.imagebind.eval()
-        self.imagebind.to(self.device)
+    def __init__(
+        self,
+        snap_to_keyframes: bool = False,
+        sparse_video_sampling: bool = False,
+        quantize: bool = False,
+        num_threads: Optional[int] = None,
+        backend: str = TORCH_BACKEND,
+        modalities: Optional[List[str]] = None,
+        idle_timeout: Optional[float] = None,
+        preprocess_workers: int = PREPROCESS_WORKERS,
+    ):
+        """
+        Args:
+            snap_to_keyframes (bool): Move sampled video frames onto nearby keyframes (see
+                sample_video_frames). Needs sparse_video_sampling.
+            sparse_video_sampling (bool): Decode only the sampled video frames, resized by decord
+                (see load_and_transform_video_data_sparse), instead of going through ImageBind's
+                loader. Faster, but not bit-identical to the embeddings validators compute, see
+                validator-api/check_imagebind_accuracy.py.
+            quantize (bool): CPU-optimized inference: the linear layers are dynamically quantized to
+                int8, which only runs on CPU, so this also keeps the model on the CPU. Embeddings
+                differ slightly from the fp32 model's, see validator-api/check_imagebind_accuracy.py.
+            num_threads (int, optional): Intra-op threads used for CPU inference.
+            backend (str): TORCH_BACKEND, or ONNX_BACKEND to run the model on CPU under ONNX Runtime
+                (see omega.imagebind_onnx).
+            modalities (List[str], optional): Modalities loaded up front with the PyTorch backend
+                (text, vision and audio by default). Others are loaded on first use.
+            idle_timeout (float, optional): Release the weights of modalities that have not been
+                used for this many seconds (PyTorch backend only).
+            preprocess_workers (int): Threads that decode and transform videos for embed_async, so
+                inputs of the next request are prepared while the model runs on the current one.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown ImageBind backend {backend}, expected one of {BACKENDS}")
+        if backend == ONNX_BACKEND and quantize:
+            raise ValueError("The ONNX backend does not support quantization")
+        on_cpu = quantize or backend == ONNX_BACKEND
+        self.device = "cuda:0" if torch.cuda.is_available() and not on_cpu else "cpu"
+        if snap_to_keyframes and not sparse_video_sampling:
+            raise ValueError("snap_to_keyframes needs sparse_video_sampling")
+        self.snap_to_keyframes = snap_to_keyframes
+        self.sparse_video_sampling = sparse_video_sampling
+        self.model_version = IMAGEBIND_VERSION
+        self.preprocess_executor = ThreadPoolExecutor(preprocess_workers, thread_name_prefix="imagebind-preprocess")
+        # a single thread runs the model for the async methods, one forward pass at a time
+        self.model_executor = ThreadPoolExecutor(1, thread_name_prefix="imagebind-model")
+        if quantize:
+            self.model_version += QUANTIZED_VERSION_SUFFIX
+        elif backend == ONNX_BACKEND:
+            self.model_version += ONNX_VERSION_SUFFIX
+        # the video embeddings change too, so they must not be mixed with the reference loader's
+        if sparse_video_sampling:
+            self.model_version += SPARSE_VERSION_SUFFIX
+        if snap_to_keyframes:
+            self.model_version += KEYFRAMES_VERSION_SUFFIX
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        if backend == ONNX_BACKEND:
+            from omega.imagebind_onnx import OnnxImageBind
+            self.imagebind = OnnxImageBind(IMAGEBIND_VERSION, self.load_torch_model, num_threads=num_threads)
+        else:
+            self.imagebind = LazyImageBindModel(
+                self.device,
+                modalities=DEFAULT_MODALITIES if modalities is None else modalities,
+                quantize=quantize,
+                idle_timeout=idle_timeout,
+            )
+
+    def load_torch_model(self) -> torch.nn.Module:
+        return LazyImageBindModel(self.device, modalities=DEFAULT_MODALITIES).model
+
+    @torch.inference_mode()
+    def run_model(self, inputs: dict) -> dict:
+        return self.imagebind(inputs)
 
     def get_inputs(self, descriptions: List[str], video_files: List[BinaryIO]) -> dict:
         audio_files = [video_utils.copy_audio(video_file.name) for video_file in video_files]
         audio_filepaths = [audio_file.name for audio_file in audio_files]
         video_filepaths = [video_file.name for video_file in video_files]
         try:
-            video_data = data.load_and_transform_video_data(video_filepaths, self.device)
+            if self.sparse_video_sampling:
+                video_data = load_and_transform_video_data_sparse(video_filepaths, self.device, self.snap_to_keyframes)
+            else:
+                video_data = data.load_and_transform_video_data(video_filepaths, self.device)
             audio_data = data.load_and_transform_audio_data(audio_filepaths, self.device)
             inputs = {
                 ModalityType.TEXT: load_and_transform_text(descriptions, self.device),
@@ -62,7 +280,14 @@ class ImageBind:
             for audio_file in audio_files:
                 audio_file.close()
 
-    @torch.no_grad()
+    def get_media_inputs(self, descriptions: List[str], media: List[media_decode.DecodedMedia]) -> dict:
+        return {
+            ModalityType.TEXT: load_and_transform_text(descriptions, self.device),
+            ModalityType.VISION: load_and_transform_decoded_video(media, self.device),
+            ModalityType.AUDIO: load_and_transform_decoded_audio(media, self.device),
+        }
+
+    @torch.inference_mode()
     def embed(self, descriptions: List[str], video_files: List[BinaryIO]) -> Embeddings:
         inputs = self.get_inputs(descriptions, video_files)
         embeddings = self.imagebind(inputs)
@@ -72,16 +297,58 @@ class ImageBind:
             description=embeddings[ModalityType.TEXT]
         )
 
-    @torch.no_grad()
+    @torch.inference_mode()
+    def embed_media(self, descriptions: List[str], media: List[media_decode.DecodedMedia]) -> Embeddings:
+        """Like `embed`, for clips decoded in memory by media_decode.decode_media."""
+        inputs = self.get_media_inputs(descriptions, media)
+        embeddings = self.imagebind(inputs)
+        return Embeddings(
+            video=embeddings[ModalityType.VISION],
+            audio=embeddings[ModalityType.AUDIO],
+            description=embeddings[ModalityType.TEXT]
+        )
+
+    @torch.inference_mode()
     def embed_text(self, texts: List[str]) -> torch.Tensor:
-        return self.imagebind({
-            ModalityType.TEXT: load_and_transform_text(texts, self.device),
-        })[ModalityType.TEXT]
+        """
+        Embeds texts, reusing the embeddings of recently embedded texts. Only texts that are not in
+        TEXT_EMBEDDING_CACHE go through the model, in a single batch.
+        """
+        keys = [(normalize_text(text), self.model_version) for text in texts]
+        embeddings = {key: TEXT_EMBEDDING_CACHE.get(key) for key in keys}
+        missing = {key: text for key, text in zip(keys, texts) if embeddings[key] is None}
+        if missing:
+            new_embeddings = self.imagebind({
+                ModalityType.TEXT: load_and_transform_text(list(missing.values()), self.device),
+            })[ModalityType.TEXT]
+            for key, embedding in zip(missing, new_embeddings):
+                # a view would keep the whole batch output alive for as long as the row is cached
+                TEXT_EMBEDDING_CACHE.put(key, embedding.clone())
+                embeddings[key] = embedding
+        return torch.stack([embeddings[key] for key in keys], dim=0)
+
+    @torch.inference_mode()
+    def embed_images(self, images: List[bytes]) -> torch.Tensor:
+        """Embeds encoded images (e.g. JPEG thumbnails) with the vision trunk."""
+        image_files = []
+        try:
+            for image in images:
+                image_file = tempfile.NamedTemporaryFile(suffix=".jpg")
+                image_files.append(image_file)
+                image_file.write(image)
+                image_file.flush()
+            vision_data = data.load_and_transform_vision_data([f.name for f in image_files], self.device)
+        finally:
+            for image_file in image_files:
+                image_file.close()
+        return self.imagebind({ModalityType.VISION: vision_data})[ModalityType.VISION]
 
-    @torch.no_grad()
     async def embed_async(self, descriptions: List[str], video_files: List[BinaryIO]) -> Embeddings:
-        inputs = self.get_inputs(descriptions, video_files)  # cannot be async
-        embeddings = await run_async(self.imagebind, inputs)
+        loop = asyncio.get_running_loop()
+        inputs = await loop.run_in_executor(
+            self.preprocess_executor, functools.partial(self.get_inputs, descriptions, video_files)
+        )
+        embeddings = await loop.run_in_executor(self.model_executor, self.run_model, inputs)
         return Embeddings(
             video=embeddings[ModalityType.VISION],
             audio=embeddings[ModalityType.AUDIO],
@@ -89,4 +356,4 @@ class ImageBind:
         )
 
     async def embed_text_async(self, texts: List[str]) -> torch.Tensor:
-        return await run_async(self.embed_text, texts)
+        return await asyncio.get_running_loop().run_in_executor(self.model_executor, self.embed_text, texts)
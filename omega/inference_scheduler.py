@@ -0,0 +1,205 @@
+import asyncio
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import BinaryIO, List, Optional
+
+import torch
+
+from omega.imagebind_wrapper import ImageBind, Embeddings, ModalityType
+
+
+TEXT_REQUEST = "text"
+VIDEO_REQUEST = "video"
+
+
+class InferenceRequest:
+    def __init__(self, kind: str, args: tuple, size: int):
+        self.kind = kind
+        self.args = args  # texts, or the preprocessed model inputs of videos
+        self.size = size  # number of texts / videos
+        self.future = Future()
+        self.enqueued_at = None
+
+
+class InferenceScheduler:
+    """
+    Runs all ImageBind calls of a process on a single scheduler thread, batching concurrent requests.
+
+    Callers enqueue text or video embedding requests and get a future back. The scheduler takes
+    the first waiting request, keeps collecting requests for up to `max_wait` seconds (or until
+    `max_text_batch` texts or `max_video_batch` videos are waiting), and then runs one forward pass
+    per kind of request for the whole micro-batch. Videos are decoded and transformed in the
+    ImageBind's preprocessing threads before they are queued, so the next requests are prepared
+    while a batch runs. It exposes the same embed / embed_text (and async) methods as ImageBind,
+    so it can be used in its place.
+    """
+
+    def __init__(
+        self,
+        imagebind: ImageBind,
+        max_wait: float = 0.02,
+        max_text_batch: int = 64,
+        max_video_batch: int = 8,
+    ):
+        self.imagebind = imagebind
+        self.max_wait = max_wait
+        self.max_batch_sizes = {TEXT_REQUEST: max_text_batch, VIDEO_REQUEST: max_video_batch}
+        self.queue: "queue.Queue[Optional[InferenceRequest]]" = queue.Queue()
+        self.metrics_lock = threading.Lock()
+        self.max_queue_depth = 0
+        self.num_batches = collections.Counter()
+        self.num_items = collections.Counter()
+        self.batch_sizes = {kind: collections.Counter() for kind in self.max_batch_sizes}
+        self.queue_seconds = collections.Counter()
+        self.forward_seconds = collections.Counter()
+        self.thread = threading.Thread(target=self.run, daemon=True, name="imagebind-scheduler")
+        self.thread.start()
+
+    @property
+    def device(self) -> str:
+        return self.imagebind.device
+
+    @property
+    def model_version(self) -> str:
+        return self.imagebind.model_version
+
+    def enqueue(self, request: InferenceRequest) -> None:
+        request.enqueued_at = time.time()
+        self.queue.put(request)
+        with self.metrics_lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def submit_text(self, texts: List[str]) -> Future:
+        request = InferenceRequest(TEXT_REQUEST, (list(texts),), len(texts))
+        self.enqueue(request)
+        return request.future
+
+    def submit_videos(self, descriptions: List[str], video_files: List[BinaryIO]) -> Future:
+        """Preprocesses the videos in the background and queues their model inputs once they are ready."""
+        request = InferenceRequest(VIDEO_REQUEST, (), len(video_files))
+
+        def enqueue_inputs(preprocessing: Future):
+            try:
+                request.args = (preprocessing.result(),)
+            except Exception as e:
+                if request.future.set_running_or_notify_cancel():
+                    request.future.set_exception(e)
+                return
+            self.enqueue(request)
+
+        self.imagebind.preprocess_executor.submit(
+            self.imagebind.get_inputs, list(descriptions), list(video_files)
+        ).add_done_callback(enqueue_inputs)
+        return request.future
+
+    def embed_text(self, texts: List[str]) -> torch.Tensor:
+        return self.submit_text(texts).result()
+
+    def embed(self, descriptions: List[str], video_files: List[BinaryIO]) -> Embeddings:
+        return self.submit_videos(descriptions, video_files).result()
+
+    async def embed_text_async(self, texts: List[str]) -> torch.Tensor:
+        return await asyncio.wrap_future(self.submit_text(texts))
+
+    async def embed_async(self, descriptions: List[str], video_files: List[BinaryIO]) -> Embeddings:
+        return await asyncio.wrap_future(self.submit_videos(descriptions, video_files))
+
+    def shutdown(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+
+    def metrics(self) -> dict:
+        with self.metrics_lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                **{
+                    kind: {
+                        "batches": self.num_batches[kind],
+                        "items": self.num_items[kind],
+                        "mean_batch_size": self.num_items[kind] / max(self.num_batches[kind], 1),
+                        "batch_sizes": dict(sorted(self.batch_sizes[kind].items())),
+                        "mean_queue_seconds": self.queue_seconds[kind] / max(self.num_batches[kind], 1),
+                        "mean_forward_seconds": self.forward_seconds[kind] / max(self.num_batches[kind], 1),
+                    }
+                    for kind in self.max_batch_sizes
+                },
+            }
+
+    def collect_batch(self, first: InferenceRequest) -> List[InferenceRequest]:
+        batch = [first]
+        sizes = collections.Counter({first.kind: first.size})
+        window_end = time.time() + self.max_wait
+        while all(sizes[kind] < max_size for kind, max_size in self.max_batch_sizes.items()):
+            timeout = window_end - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)  # finish this batch, then shut down
+                break
+            batch.append(request)
+            sizes[request.kind] += request.size
+        return batch
+
+    def run(self) -> None:
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+            batch = self.collect_batch(request)
+            for kind in self.max_batch_sizes:
+                # skip requests whose caller gave up while they were queued
+                requests = [r for r in batch if r.kind == kind and r.future.set_running_or_notify_cancel()]
+                if requests:
+                    self.run_batch(kind, requests)
+
+    def run_batch(self, kind: str, requests: List[InferenceRequest]) -> None:
+        start = time.time()
+        try:
+            if kind == TEXT_REQUEST:
+                results = self.embed_text_batch(requests)
+            else:
+                results = self.embed_video_batch(requests)
+            for request, result in zip(requests, results):
+                request.future.set_result(result)
+        except Exception as e:
+            if len(requests) == 1:
+                requests[0].future.set_exception(e)
+            else:
+                # one bad input should not fail the other callers' requests
+                for request in requests:
+                    self.run_batch(kind, [request])
+                return
+        with self.metrics_lock:
+            size = sum(request.size for request in requests)
+            self.num_batches[kind] += 1
+            self.num_items[kind] += size
+            self.batch_sizes[kind][size] += 1
+            self.queue_seconds[kind] += sum(start - request.enqueued_at for request in requests) / len(requests)
+            self.forward_seconds[kind] += time.time() - start
+
+    def embed_text_batch(self, requests: List[InferenceRequest]) -> List[torch.Tensor]:
+        embeddings = self.imagebind.embed_text([text for request in requests for text in request.args[0]])
+        return list(torch.split(embeddings, [request.size for request in requests]))
+
+    def embed_video_batch(self, requests: List[InferenceRequest]) -> List[Embeddings]:
+        embeddings = self.imagebind.run_model({
+            modality: torch.cat([request.args[0][modality] for request in requests], dim=0)
+            for modality in requests[0].args[0]
+        })
+        sizes = [request.size for request in requests]
+        return [
+            Embeddings(video=video, audio=audio, description=description)
+            for video, audio, description in zip(
+                torch.split(embeddings[ModalityType.VISION], sizes),
+                torch.split(embeddings[ModalityType.AUDIO], sizes),
+                torch.split(embeddings[ModalityType.TEXT], sizes),
+            )
+        ]
@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+from typing import Iterable, List, Optional, Set, Tuple
+
+import bittensor as bt
+import numpy as np
+
+from omega.protocol import EMBEDDING_DIM, EMBEDDING_FIELDS, VideoMetadata
+
+
+GROW_ROWS = 4096  # rows added to the embedding files whenever they fill up
+SEARCH_CHUNK_ROWS = 65536  # rows scored per matrix product, bounds memory during a search
+EMBEDDINGS_FILENAME = "embeddings.f32"
+UNIT_VIDEO_FILENAME = "video_unit.f32"
+LOG_FILENAME = "log.jsonl"
+
+
+class VideoInventory:
+    """
+    Persistent inventory of embedded clips that miners can answer queries from directly.
+
+    Each clip's video / audio / description embeddings are appended to a memory-mapped float32
+    file, together with a unit-normalized copy of the video embedding used for retrieval, and its
+    metadata is appended to a JSON-lines log. Nearest-neighbour retrieval is an exact cosine
+    top-k over the memory-mapped unit vectors, done in chunks, which takes milliseconds at the
+    tens of thousands of clips an inventory holds. Clips are handed out once: `take` removes
+    what it returns, since a clip that was already submitted earns no novelty, and removed clips
+    are never added again.
+    """
+
+    def __init__(self, inventory_dir: str, dim: int = EMBEDDING_DIM):
+        self.inventory_dir = os.path.expanduser(inventory_dir)
+        self.dim = dim
+        self.lock = threading.Lock()
+        self.metadata: List[Optional[dict]] = []  # row -> metadata, None once removed
+        self.rows_by_video_id = {}
+        self.removed_video_ids: Set[str] = set()
+        self.capacity = 0
+        self.embeddings: Optional[np.memmap] = None
+        self.unit_video: Optional[np.memmap] = None
+        os.makedirs(self.inventory_dir, exist_ok=True)
+        self._load()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.inventory_dir, filename)
+
+    def __len__(self) -> int:
+        return len(self.rows_by_video_id)
+
+    def _load(self) -> None:
+        log_path = self._path(LOG_FILENAME)
+        if os.path.exists(log_path):
+            offset, torn_offset = 0, None
+            with open(log_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        torn_offset = offset  # the last append was interrupted
+                        break
+                    offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        bt.logging.warning(f"Skipping corrupted record in {log_path}")
+                        continue
+                    if "remove" in record:
+                        self.removed_video_ids.add(record["remove"])
+                        row = self.rows_by_video_id.pop(record["remove"], None)
+                        if row is not None:
+                            self.metadata[row] = None
+                    else:
+                        self.rows_by_video_id[record["video_id"]] = len(self.metadata)
+                        self.metadata.append(record)
+            if torn_offset is not None:
+                # later appends would otherwise be glued onto the partial record
+                with open(log_path, "r+b") as f:
+                    f.truncate(torn_offset)
+        self._open(max(len(self.metadata), GROW_ROWS))
+        if len(self.metadata) > 2 * len(self.rows_by_video_id) + GROW_ROWS:
+            self._compact()
+        if self.rows_by_video_id:
+            bt.logging.info(f"Loaded {len(self)} clips into the local video inventory")
+
+    def _open(self, capacity: int) -> None:
+        """(Re)maps the embedding files, growing them to hold `capacity` rows."""
+        for filename, row_shape in [
+            (EMBEDDINGS_FILENAME, (len(EMBEDDING_FIELDS), self.dim)),
+            (UNIT_VIDEO_FILENAME, (self.dim,)),
+        ]:
+            path = self._path(filename)
+            nbytes = capacity * int(np.prod(row_shape)) * np.dtype(np.float32).itemsize
+            with open(path, "ab") as f:
+                if f.tell() < nbytes:
+                    f.truncate(nbytes)
+            memmap = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, *row_shape))
+            if filename == EMBEDDINGS_FILENAME:
+                self.embeddings = memmap
+            else:
+                self.unit_video = memmap
+        self.capacity = capacity
+
+    def _compact(self) -> None:
+        """Rewrites the inventory without removed rows."""
+        live_rows = [row for row, metadata in enumerate(self.metadata) if metadata is not None]
+        embeddings = np.array(self.embeddings[live_rows])
+        unit_video = np.array(self.unit_video[live_rows])
+        self.embeddings = self.unit_video = None
+        for filename in [EMBEDDINGS_FILENAME, UNIT_VIDEO_FILENAME]:
+            os.remove(self._path(filename))
+        self._open(max(len(live_rows), GROW_ROWS))
+        self.embeddings[:len(live_rows)] = embeddings
+        self.unit_video[:len(live_rows)] = unit_video
+        self.embeddings.flush()
+        self.unit_video.flush()
+
+        self.metadata = [self.metadata[row] for row in live_rows]
+        self.rows_by_video_id = {metadata["video_id"]: row for row, metadata in enumerate(self.metadata)}
+        tmp_path = f"{self._path(LOG_FILENAME)}.tmp"
+        with open(tmp_path, "w") as f:
+            for video_id in self.removed_video_ids:
+                f.write(json.dumps({"remove": video_id}) + "\n")
+            for metadata in self.metadata:
+                f.write(json.dumps(metadata) + "\n")
+        os.replace(tmp_path, self._path(LOG_FILENAME))
+
+    def add(self, video_metadata: Iterable[VideoMetadata]) -> int:
+        """Appends clips that are not (and never were) in the inventory. Returns the number of clips added."""
+        added = 0
+        with self.lock:
+            with open(self._path(LOG_FILENAME), "a") as log:
+                for video in video_metadata:
+                    if video.video_id in self.rows_by_video_id or video.video_id in self.removed_video_ids:
+                        continue
+                    row = len(self.metadata)
+                    if row >= self.capacity:
+                        self.embeddings.flush()
+                        self.unit_video.flush()
+                        self._open(self.capacity + GROW_ROWS)
+                    embeddings = np.array([video.get_embedding(field) for field in EMBEDDING_FIELDS])
+                    self.embeddings[row] = embeddings
+                    self.unit_video[row] = embeddings[0] / max(np.linalg.norm(embeddings[0]), 1e-8)
+                    metadata = video.dict(exclude={*EMBEDDING_FIELDS, "embedding_encoding"})
+                    self.metadata.append(metadata)
+                    self.rows_by_video_id[video.video_id] = row
+                    log.write(json.dumps(metadata) + "\n")
+                    added += 1
+            self.embeddings.flush()
+            self.unit_video.flush()
+        return added
+
+    def _to_video_metadata(self, row: int) -> VideoMetadata:
+        video_emb, audio_emb, description_emb = np.array(self.embeddings[row])
+        return VideoMetadata(
+            **self.metadata[row],
+            video_emb=video_emb.tolist(),
+            audio_emb=audio_emb.tolist(),
+            description_emb=description_emb.tolist(),
+        )
+
+    def _search(
+        self, query_emb: np.ndarray, k: int, min_score: Optional[float], exclude: Set[str]
+    ) -> List[Tuple[int, float]]:
+        query_emb = np.asarray(query_emb, dtype=np.float32)
+        query_emb = query_emb / max(np.linalg.norm(query_emb), 1e-8)
+        num_rows = len(self.metadata)
+        # over-fetch so removed / excluded rows do not leave us short
+        num_candidates = k + len(exclude) + (num_rows - len(self))
+        candidates = []
+        for chunk_start in range(0, num_rows, SEARCH_CHUNK_ROWS):
+            chunk_end = min(chunk_start + SEARCH_CHUNK_ROWS, num_rows)
+            scores = self.unit_video[chunk_start:chunk_end] @ query_emb
+            top = np.argpartition(-scores, min(num_candidates, len(scores)) - 1)[:num_candidates]
+            candidates.extend((chunk_start + int(i), float(scores[i])) for i in top)
+        candidates.sort(key=lambda candidate: -candidate[1])
+
+        results = []
+        for row, score in candidates:
+            if len(results) == k or (min_score is not None and score < min_score):
+                break
+            metadata = self.metadata[row]
+            if metadata is None or metadata["video_id"] in exclude:
+                continue
+            results.append((row, score))
+        return results
+
+    def search(
+        self, query_emb: np.ndarray, k: int, min_score: Optional[float] = None, exclude: Optional[Set[str]] = None
+    ) -> List[Tuple[VideoMetadata, float]]:
+        """Returns up to `k` clips whose video embedding is closest to `query_emb`, with their cosine scores."""
+        with self.lock:
+            return [
+                (self._to_video_metadata(row), score)
+                for row, score in self._search(query_emb, k, min_score, exclude or set())
+            ]
+
+    def take(
+        self, query_emb: np.ndarray, k: int, min_score: Optional[float] = None, exclude: Optional[Set[str]] = None
+    ) -> List[VideoMetadata]:
+        """Like `search`, but removes the returned clips from the inventory."""
+        with self.lock:
+            rows = [row for row, _ in self._search(query_emb, k, min_score, exclude or set())]
+            videos = [self._to_video_metadata(row) for row in rows]
+            with open(self._path(LOG_FILENAME), "a") as log:
+                for row, video in zip(rows, videos):
+                    self.metadata[row] = None
+                    del self.rows_by_video_id[video.video_id]
+                    self.removed_video_ids.add(video.video_id)
+                    log.write(json.dumps({"remove": video.video_id}) + "\n")
+        return videos
@@ -0,0 +1,60 @@
+import asyncio
+import contextlib
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class JobEngine:
+    """
+    Runs blocking miner work off the axon's event loop, so one slow request does not stall
+    blacklist / priority checks or other validators' requests.
+
+    I/O-bound work (searching, downloading, embedding) runs on a thread pool, while ffmpeg work
+    can be handed to `process_pool`. At most `max_concurrent_jobs` requests are processed at once;
+    additional requests wait for a free slot.
+    """
+
+    def __init__(self, max_concurrent_jobs: int = 2, process_workers: int = 0):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        # every job holds one thread for its whole lifetime, plus one for short-lived calls
+        self.thread_pool = ThreadPoolExecutor(
+            max_workers=max_concurrent_jobs + 1, thread_name_prefix="omega-job"
+        )
+        self.process_pool: Optional[ProcessPoolExecutor] = None
+        if process_workers > 0:
+            # spawn rather than fork: the miner process holds CUDA state and many threads
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=process_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            # spawned workers re-import the main module (torch, imagebind, ...), which must not
+            # happen inside the first live request, so start them all now
+            for future in [self.process_pool.submit(os.getpid) for _ in range(process_workers)]:
+                future.result()
+        self.active_jobs = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @contextlib.asynccontextmanager
+    async def job(self):
+        """Holds one of the `max_concurrent_jobs` slots for the duration of the block."""
+        if self._slots is None:
+            # created lazily so it binds to the axon's event loop
+            self._slots = asyncio.Semaphore(self.max_concurrent_jobs)
+        async with self._slots:
+            self.active_jobs += 1
+            try:
+                yield
+            finally:
+                self.active_jobs -= 1
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Runs a blocking function on the thread pool and awaits its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_pool, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self.thread_pool.shutdown(wait=False)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
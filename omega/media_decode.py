@@ -0,0 +1,167 @@
+import math
+import os
+import subprocess
+import threading
+from fractions import Fraction
+from typing import List, Optional, Tuple
+
+import ffmpeg
+import numpy as np
+from pydantic import BaseModel
+
+
+# sampling used by ImageBind's video / audio loaders
+FRAME_SIZE = 224  # frames are scaled so their short side is this long
+VIDEO_CLIP_DURATION = 2
+VIDEO_CLIPS_PER_VIDEO = 5
+FRAMES_PER_CLIP = 2
+AUDIO_SAMPLE_RATE = 16000
+
+
+class MediaInfo(BaseModel):
+    duration: float
+    fps: Fraction
+    width: int
+    height: int
+    has_audio: bool
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+class DecodedMedia(BaseModel):
+    """
+    The only parts of a clip ImageBind looks at: the sampled frames of each vision clip, scaled
+    for the vision trunk, and the clip's audio track as 16 kHz mono PCM.
+    """
+    class Config:
+        arbitrary_types_allowed = True
+
+    frames: np.ndarray  # (VIDEO_CLIPS_PER_VIDEO, FRAMES_PER_CLIP, height, width, 3) uint8 RGB
+    waveform: np.ndarray  # (samples,) float32 in [-1, 1]
+
+
+def _parse_rate(rate: Optional[str]) -> Fraction:
+    try:
+        return Fraction(rate)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return Fraction(0)
+
+
+def probe_media(video_path: str) -> MediaInfo:
+    metadata = ffmpeg.probe(video_path)
+    video_stream = next((stream for stream in metadata['streams'] if stream['codec_type'] == 'video'), None)
+    if video_stream is None:
+        raise ValueError(f"No video stream in {video_path}")
+    fps = _parse_rate(video_stream.get("avg_frame_rate")) or _parse_rate(video_stream.get("r_frame_rate"))
+    if fps <= 0:
+        raise ValueError(f"Cannot determine the frame rate of {video_path}")
+    width, height = int(video_stream["width"]), int(video_stream["height"])
+    # ffmpeg applies the rotation when decoding, so report the size of the decoded frames
+    rotation = int(video_stream.get("tags", {}).get("rotate", 0))
+    for side_data in video_stream.get("side_data_list", []):
+        rotation = int(side_data.get("rotation", rotation))
+    if abs(rotation) % 180 == 90:
+        width, height = height, width
+    return MediaInfo(
+        duration=float(video_stream.get("duration") or metadata["format"]["duration"]),
+        fps=fps,
+        width=width,
+        height=height,
+        has_audio=any(stream["codec_type"] == "audio" for stream in metadata["streams"]),
+    )
+
+
+def get_clip_timepoints(duration: float, clip_duration: float, clips_per_video: int) -> List[Tuple[Fraction, Fraction]]:
+    """The clip boundaries of ImageBind's ConstantClipsPerVideoSampler, for a media of `duration` seconds."""
+    max_clip_start = Fraction(max(duration - clip_duration, 0))
+    step = max_clip_start / max(clips_per_video - 1, 1)
+    return [(step * i, step * i + clip_duration) for i in range(clips_per_video)]
+
+
+def get_frame_indices(duration: float, fps: Fraction, num_frames: Optional[int] = None) -> List[int]:
+    """
+    Indices of the frames ImageBind samples from a clip: the first and last frame of each vision
+    clip, exactly as decoding every frame of the clip and subsampling it would pick them.
+    """
+    if num_frames is None:
+        num_frames = int(duration * fps)
+    num_frames = max(num_frames, 1)
+    indices = []
+    for start, end in get_clip_timepoints(duration, VIDEO_CLIP_DURATION, VIDEO_CLIPS_PER_VIDEO):
+        start_index = min(math.ceil(start * fps), num_frames - 1)
+        end_index = min(math.ceil(end * fps), num_frames)
+        indices.extend([start_index, max(end_index - 1, start_index)])
+    return indices
+
+
+def get_scaled_size(width: int, height: int, size: int = FRAME_SIZE) -> Tuple[int, int]:
+    """The frame size after scaling the short side to `size`, rounded like pytorchvideo's ShortSideScale."""
+    if width < height:
+        return size, int(math.floor(height / width * size))
+    return int(math.floor(width / height * size)), size
+
+
+def decode_media(video_path: str, start: int, end: int, info: Optional[MediaInfo] = None) -> DecodedMedia:
+    """
+    Decodes [start, end] of the video in a single ffmpeg pass. Only the frames ImageBind samples
+    are kept, scaled by ffmpeg and written to stdout as raw RGB, while the audio is downmixed and
+    resampled to 16 kHz mono PCM on a second pipe, so nothing is written to disk.
+    """
+    if info is None:
+        info = probe_media(video_path)
+    if not info.has_audio:
+        raise ValueError(f"No audio stream in {video_path}")
+    duration = min(end, info.duration) - start
+    if duration <= 0:
+        raise ValueError(f"Clip [{start}, {end}] is outside of {video_path} ({info.duration} seconds)")
+
+    indices = get_frame_indices(duration, info.fps)
+    unique_indices = sorted(set(indices))
+    width, height = get_scaled_size(info.width, info.height)
+    select = "+".join(f"eq(n\\,{index})" for index in unique_indices)
+
+    audio_read_fd, audio_write_fd = os.pipe()
+    command = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-ss", str(start), "-to", str(end), "-i", video_path,
+        "-map", "0:v:0", "-vf", f"select={select},scale={width}:{height}:flags=bilinear",
+        "-vsync", "passthrough", "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
+        "-map", "0:a:0", "-af", "pan=mono|c0=c0", "-ar", str(AUDIO_SAMPLE_RATE),
+        "-f", "s16le", f"pipe:{audio_write_fd}",
+    ]
+    audio = {}
+
+    def read_audio():
+        with os.fdopen(audio_read_fd, "rb") as audio_pipe:
+            audio["data"] = audio_pipe.read()
+
+    try:
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, pass_fds=(audio_write_fd,)
+        )
+    except Exception:
+        os.close(audio_read_fd)
+        raise
+    finally:
+        os.close(audio_write_fd)
+    # both pipes must be drained at the same time, or ffmpeg blocks on whichever fills up first
+    audio_reader = threading.Thread(target=read_audio, daemon=True)
+    audio_reader.start()
+    video_data, stderr = process.communicate()
+    audio_reader.join()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {video_path}: {stderr.decode(errors='replace').strip()}")
+
+    frame_bytes = width * height * 3
+    num_decoded = len(video_data) // frame_bytes
+    if num_decoded == 0:
+        raise ValueError(f"No frames decoded from {video_path}")
+    decoded = np.frombuffer(video_data[:num_decoded * frame_bytes], dtype=np.uint8).reshape(num_decoded, height, width, 3)
+    # frames past the end of a truncated stream fall back to the last decoded one
+    positions = {index: min(i, num_decoded - 1) for i, index in enumerate(unique_indices)}
+    frames = decoded[[positions[index] for index in indices]].reshape(
+        VIDEO_CLIPS_PER_VIDEO, FRAMES_PER_CLIP, height, width, 3
+    )
+    waveform = np.frombuffer(audio.get("data", b""), dtype="<i2").astype(np.float32) / 32768.0
+    return DecodedMedia(frames=frames, waveform=waveform)
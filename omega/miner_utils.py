@@ -1,13 +1,20 @@
 import os
+import threading
 import time
-from typing import List, Tuple
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, BinaryIO, Callable, List, Optional, Tuple
 
 import bittensor as bt
+import numpy as np
+from pydantic import BaseModel
 
 from omega.protocol import VideoMetadata
 from omega.imagebind_wrapper import ImageBind
 from omega.constants import MAX_VIDEO_LENGTH, FIVE_MINUTES
-from omega import video_utils
+from omega import media_decode, video_utils
+from omega.embedding_cache import EmbeddingCache, cache_key
+from omega.video_cache import VideoCache
+from omega.inventory import VideoInventory
 
 
 if os.getenv("OPENAI_API_KEY"):
@@ -16,6 +23,12 @@ if os.getenv("OPENAI_API_KEY"):
 else:
     OPENAI_CLIENT = None
 
+DOWNLOAD_STAGE = "download"
+CLIP_STAGE = "clip"
+EMBED_STAGE = "embed"
+STOP_POLL_INTERVAL = 0.5  # seconds between checks of `should_stop` while waiting for workers
+SINGLE_PASS_VERSION_SUFFIX = "-single-pass"  # embed_media output differs slightly from embed's
+
 
 def get_description(yt: video_utils.YoutubeDL, video_path: str) -> str:
     """
@@ -43,56 +56,509 @@ def get_relevant_timestamps(query: str, yt: video_utils.YoutubeDL, video_path: s
     return start_time, end_time
 
 
-def search_and_embed_videos(query: str, num_videos: int, imagebind: ImageBind) -> List[VideoMetadata]:
+class PipelineConfig(BaseModel):
+    """
+    Tunables for the download -> clip -> embed pipeline used by search_and_embed_videos.
+    """
+    download_workers: int = 4
+    clip_workers: int = 2
+    embed_batch_size: int = 8
+    embed_max_wait: float = 2.0
+    inventory_min_score: float = 0.2
+    # search this many times the missing videos and download the best-matching ones; 0 to disable
+    prerank_multiplier: float = 3.0
+    # embed candidate thumbnails and skip downloading the ones that do not match the query
+    thumbnail_prescreen: bool = False
+    thumbnail_min_score: float = 0.1
+    # decode clips in memory in a single ffmpeg pass instead of going through temp files
+    single_pass_decode: bool = False
+
+    @classmethod
+    def from_config(cls, config: "bt.config") -> "PipelineConfig":
+        return cls(
+            download_workers=config.neuron.download_workers,
+            clip_workers=config.neuron.clip_workers,
+            embed_batch_size=config.neuron.embed_batch_size,
+            embed_max_wait=config.neuron.embed_max_wait,
+            inventory_min_score=config.neuron.inventory_min_score,
+            prerank_multiplier=config.neuron.prerank_multiplier,
+            thumbnail_prescreen=config.neuron.thumbnail_prescreen,
+            thumbnail_min_score=config.neuron.thumbnail_min_score,
+            single_pass_decode=config.neuron.single_pass_decode,
+        )
+
+    def embedding_version(self, imagebind: ImageBind) -> str:
+        """Identifies how this pipeline computes embeddings, for the embedding cache keys."""
+        if self.single_pass_decode:
+            return imagebind.model_version + SINGLE_PASS_VERSION_SUFFIX
+        return imagebind.model_version
+
+
+class StageTimings:
+    """
+    Exponential moving averages of how long each pipeline stage takes, shared across requests
+    so the deadline scheduler can estimate how much work is left for an in-flight candidate.
+    Embedding times are tracked per clip.
+    """
+
+    STAGES = [DOWNLOAD_STAGE, CLIP_STAGE, EMBED_STAGE]
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        # conservative starting guesses until we have observed a few requests
+        self.averages = {DOWNLOAD_STAGE: 15.0, CLIP_STAGE: 2.0, EMBED_STAGE: 3.0}
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.averages[stage] = (1 - self.alpha) * self.averages[stage] + self.alpha * seconds
+
+    def estimate(self, stage: str) -> float:
+        return self.averages[stage]
+
+    def remaining(self, stage: str, elapsed: float, num_clips: int = 1) -> float:
+        """
+        Estimated seconds until a candidate that has spent `elapsed` seconds in `stage` is embedded.
+        """
+        stages = self.STAGES[self.STAGES.index(stage):]
+        remaining = 0.0
+        for i, next_stage in enumerate(stages):
+            estimate = self.estimate(next_stage) * (num_clips if next_stage == EMBED_STAGE else 1)
+            remaining += max(estimate - elapsed, 0) if i == 0 else estimate
+        return remaining
+
+
+STAGE_TIMINGS = StageTimings()
+
+
+class ClippedVideo(BaseModel):
+    """
+    A downloaded search result that has been clipped and is ready to be embedded, either as a
+    clip file or, with single-pass decoding, as decoded media.
+    """
+    class Config:
+        arbitrary_types_allowed = True
+
+    result: video_utils.YoutubeResult
+    description: str
+    start_time: int
+    end_time: int
+    clip_file: Any = None
+    media: Optional[media_decode.DecodedMedia] = None
+    cache_key: Optional[str] = None
+
+
+def candidate_text(result: video_utils.YoutubeResult) -> str:
+    """The search-result text a candidate's description is built from."""
+    return f"{result.title}\n\n{result.description or ''}"
+
+
+def rank_candidates(
+    query_emb: np.ndarray, results: List[video_utils.YoutubeResult], imagebind: ImageBind
+) -> List[video_utils.YoutubeResult]:
+    """
+    Orders search results by the cosine similarity between the query and their title / description,
+    embedded together in a single text batch.
+    """
+    if not results:
+        return results
+    text_embs = imagebind.embed_text([candidate_text(result) for result in results]).cpu().numpy()
+    text_embs = text_embs / np.maximum(np.linalg.norm(text_embs, axis=1, keepdims=True), 1e-8)
+    scores = text_embs @ (query_emb / max(np.linalg.norm(query_emb), 1e-8))
+    order = np.argsort(-scores, kind="stable")
+    bt.logging.debug("Pre-ranked candidates: " + ", ".join(
+        f"{results[i].video_id} ({scores[i]:.3f})" for i in order
+    ))
+    return [results[i] for i in order]
+
+
+def prescreen_thumbnails(
+    query_emb: np.ndarray,
+    results: List[video_utils.YoutubeResult],
+    imagebind: ImageBind,
+    min_score: float,
+    min_keep: int = 0,
+    fetch_thumbnail: Callable[[str], Optional[bytes]] = video_utils.fetch_thumbnail,
+) -> List[video_utils.YoutubeResult]:
+    """
+    Drops search results whose thumbnail, embedded with the vision trunk in a single batch, scores
+    below `min_score` against the query. Results without a thumbnail are kept, and dropped results
+    are used to backfill (best first) if fewer than `min_keep` would remain. The relative order of
+    the results is preserved.
+    """
+    if not results:
+        return results
+    with ThreadPoolExecutor(max_workers=min(len(results), 8)) as pool:
+        thumbnails = list(pool.map(fetch_thumbnail, [result.video_id for result in results]))
+    fetched = [i for i, thumbnail in enumerate(thumbnails) if thumbnail]
+    if not fetched:
+        return results
+
+    image_embs = imagebind.embed_images([thumbnails[i] for i in fetched]).cpu().numpy()
+    image_embs = image_embs / np.maximum(np.linalg.norm(image_embs, axis=1, keepdims=True), 1e-8)
+    scores = dict(zip(fetched, image_embs @ (query_emb / max(np.linalg.norm(query_emb), 1e-8))))
+    dropped = sorted((i for i in fetched if scores[i] < min_score), key=lambda i: -scores[i])
+    backfill = set(dropped[:max(min_keep - (len(results) - len(dropped)), 0)])
+    for i in dropped:
+        if i not in backfill:
+            bt.logging.info(f"Skipping video {results[i].video_id}, its thumbnail scored {scores[i]:.3f}")
+    dropped = set(dropped) - backfill
+    return [result for i, result in enumerate(results) if i not in dropped]
+
+
+def candidate_cache_key(result: video_utils.YoutubeResult, embedding_version: str) -> str:
+    """
+    Embedding cache key for a search result, computable before anything is downloaded: the
+    source range we would download plus the search-result text the description is built from.
+    """
+    return cache_key(
+        result.video_id,
+        0,
+        min(result.length, FIVE_MINUTES),
+        candidate_text(result),
+        embedding_version,
+    )
+
+
+def download_candidate(
+    result: video_utils.YoutubeResult, video_cache: Optional[VideoCache] = None
+) -> Optional[BinaryIO]:
+    start = time.time()
+    download_path = video_utils.download_video(
+        result.video_id,
+        start=0,
+        end=min(result.length, FIVE_MINUTES),  # download the first 5 minutes at most
+        cache=video_cache,
+    )
+    if download_path:
+        bt.logging.info(f"Downloaded video {result.video_id} ({min(result.length, FIVE_MINUTES)}) in {time.time() - start} seconds")
+    return download_path
+
+
+def clip_candidate(
+    query: str, result: video_utils.YoutubeResult, download_path: BinaryIO, key: Optional[str] = None,
+    ffmpeg_executor: Optional[Executor] = None, single_pass_decode: bool = False,
+) -> ClippedVideo:
+    def run(func, *args):
+        if ffmpeg_executor is None:
+            return func(*args)
+        return ffmpeg_executor.submit(func, *args).result()
+
+    try:
+        if single_pass_decode:
+            media_info = run(media_decode.probe_media, download_path.name)
+            result.length = int(media_info.duration)  # correct the length
+        else:
+            result.length = run(video_utils.get_video_duration, download_path.name)  # correct the length
+        start, end = get_relevant_timestamps(query, result, download_path)
+        description = get_description(result, download_path)
+        clip = ClippedVideo(
+            result=result,
+            description=description,
+            start_time=start,
+            end_time=end,
+            cache_key=key,
+        )
+        if single_pass_decode:
+            clip.media = run(media_decode.decode_media, download_path.name, start, end, media_info)
+        else:
+            clip.clip_file = video_utils.clip_video(download_path.name, start, end, executor=ffmpeg_executor)
+        return clip
+    finally:
+        download_path.close()
+
+
+def close_stage_output(output: Any) -> None:
+    """Release the temp file held by the output of a pipeline stage that will not be consumed."""
+    if isinstance(output, ClippedVideo):
+        if output.clip_file is not None:
+            output.clip_file.close()
+    elif output is not None:
+        output.close()
+
+
+def _close_when_done(future: Future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        close_stage_output(future.result())
+
+
+def embed_clips(clips: List[ClippedVideo], imagebind: ImageBind) -> List[VideoMetadata]:
+    """
+    Embed a batch of clips with a single forward pass over the text, vision and audio trunks.
+    If the batch fails (e.g. one clip cannot be decoded), the clips are retried one at a time
+    so a single bad video does not take the rest of the batch down with it.
+    """
+    try:
+        descriptions = [clip.description for clip in clips]
+        if all(clip.media is not None for clip in clips):
+            embeddings = imagebind.embed_media(descriptions, [clip.media for clip in clips])
+        else:
+            embeddings = imagebind.embed(descriptions, [clip.clip_file for clip in clips])
+    except Exception as e:
+        if len(clips) == 1:
+            bt.logging.error(f"Error embedding video {clips[0].result.video_id}: {e}")
+            return []
+        bt.logging.warning(f"Error embedding batch of {len(clips)} videos, retrying one at a time: {e}")
+        return [video_meta for clip in clips for video_meta in embed_clips([clip], imagebind)]
+
+    return [
+        VideoMetadata(
+            video_id=clip.result.video_id,
+            description=clip.description,
+            views=clip.result.views,
+            start_time=clip.start_time,
+            end_time=clip.end_time,
+            video_emb=embeddings.video[i].tolist(),
+            audio_emb=embeddings.audio[i].tolist(),
+            description_emb=embeddings.description[i].tolist(),
+        )
+        for i, clip in enumerate(clips)
+    ]
+
+
+def search_and_embed_videos(
+    query: str,
+    num_videos: int,
+    imagebind: ImageBind,
+    pipeline_config: Optional[PipelineConfig] = None,
+    embedding_cache: Optional[EmbeddingCache] = None,
+    video_cache: Optional[VideoCache] = None,
+    deadline: Optional[float] = None,
+    ffmpeg_executor: Optional[Executor] = None,
+    inventory: Optional[VideoInventory] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> List[VideoMetadata]:
     """
     Search YouTube for videos matching the given query and return a list of VideoMetadata objects.
 
+    Candidates flow through a staged pipeline: downloads run in a bounded worker pool, clipping
+    runs in its own pool, and the embedding stage picks up whatever clips are ready and embeds
+    them in batches of up to `embed_batch_size` (flushing early once the oldest ready clip has
+    waited `embed_max_wait` seconds), so network, ffmpeg and inference work overlap. When an
+    embedding cache is given, results that were embedded before are served from it without
+    downloading anything, and newly embedded videos are added to it. When a video cache is given,
+    downloads are served from (and added to) the local cache of downloaded ranges.
+
+    When an inventory is given, the query's text embedding is matched against the stored clips
+    first, and YouTube is only searched for the shortfall.
+
+    With `prerank_multiplier` set, YouTube is searched for that many times the missing videos, the
+    results are ranked by how well their title and description match the query, and only the best
+    ones are downloaded. With `thumbnail_prescreen` set, candidates whose thumbnail does not match
+    the query are skipped as well.
+
+    With a deadline, candidates whose estimated remaining cost (from STAGE_TIMINGS) no longer fits
+    are cancelled, and whatever has been embedded by the deadline is returned. Likewise, once
+    `should_stop` returns True, all remaining work is dropped and the videos embedded so far are
+    returned.
+
     Args:
         query (str): The query to search for.
         num_videos (int, optional): The number of videos to return.
+        imagebind (ImageBind): The model used to embed the clips.
+        pipeline_config (PipelineConfig, optional): Worker counts and batching for each stage.
+        embedding_cache (EmbeddingCache, optional): Persistent cache of previously embedded videos.
+        video_cache (VideoCache, optional): Local cache of downloaded video ranges.
+        deadline (float, optional): Unix timestamp by which the results must be ready.
+        ffmpeg_executor (Executor, optional): Executor (e.g. a process pool) for the ffprobe / ffmpeg
+            calls of the clip stage. They run in the clip worker threads if not given.
+        inventory (VideoInventory, optional): Local inventory of embedded clips to answer from first.
+        should_stop (Callable[[], bool], optional): Polled while the pipeline runs, e.g. so that
+            background work yields to live requests.
 
     Returns:
         List[VideoMetadata]: A list of VideoMetadata objects representing the search results.
     """
-    # fetch more videos than we need
-    results = video_utils.search_videos(query, max_results=int(num_videos * 1.5))
+    if pipeline_config is None:
+        pipeline_config = PipelineConfig()
+
     video_metas = []
-    try:
-        # take the first N that we need
-        for result in results:
+    use_inventory = inventory is not None and len(inventory) > 0
+    query_emb = None
+    if use_inventory or pipeline_config.prerank_multiplier > 0 or pipeline_config.thumbnail_prescreen:
+        try:
+            query_emb = imagebind.embed_text([query])[0].cpu().numpy()
+        except Exception as e:
+            bt.logging.error(f"Error embedding query, skipping inventory, pre-ranking and thumbnail pre-screening: {e}")
+            use_inventory = False
+    if use_inventory:
+        start = time.time()
+        video_metas = inventory.take(query_emb, num_videos, min_score=pipeline_config.inventory_min_score)
+        bt.logging.info(f"Found {len(video_metas)} videos in the local inventory in {time.time() - start:.3f} seconds")
+        if len(video_metas) == num_videos:
+            return video_metas
+
+    # fetch more videos than we need
+    num_candidates = int((num_videos - len(video_metas)) * 1.5)
+    used_video_ids = {video.video_id for video in video_metas}
+    if pipeline_config.prerank_multiplier > 0 and query_emb is not None:
+        results = video_utils.search_videos(
+            query, max_results=int((num_videos - len(video_metas)) * pipeline_config.prerank_multiplier)
+        )
+        results = [result for result in results if result.video_id not in used_video_ids]
+        try:
+            start = time.time()
+            results = rank_candidates(query_emb, results, imagebind)
+            bt.logging.info(f"Pre-ranked {len(results)} candidates in {time.time() - start:.3f} seconds")
+        except Exception as e:
+            bt.logging.warning(f"Error pre-ranking candidates, keeping search order: {e}")
+    else:
+        results = [
+            result for result in video_utils.search_videos(query, max_results=num_candidates)
+            if result.video_id not in used_video_ids
+        ]
+    if pipeline_config.thumbnail_prescreen and query_emb is not None:
+        try:
             start = time.time()
-            download_path = video_utils.download_video(
-                result.video_id,
-                start=0,
-                end=min(result.length, FIVE_MINUTES)  # download the first 5 minutes at most
+            results = prescreen_thumbnails(
+                query_emb, results, imagebind, pipeline_config.thumbnail_min_score,
+                min_keep=num_videos - len(video_metas),
             )
-            if download_path:
-                clip_path = None
-                try:
-                    result.length = video_utils.get_video_duration(download_path.name)  # correct the length
-                    bt.logging.info(f"Downloaded video {result.video_id} ({min(result.length, FIVE_MINUTES)}) in {time.time() - start} seconds")
-                    start, end = get_relevant_timestamps(query, result, download_path)
-                    description = get_description(result, download_path)
-                    clip_path = video_utils.clip_video(download_path.name, start, end)
-                    embeddings = imagebind.embed([description], [clip_path])
-                    video_metas.append(VideoMetadata(
-                        video_id=result.video_id,
-                        description=description,
-                        views=result.views,
-                        start_time=start,
-                        end_time=end,
-                        video_emb=embeddings.video[0].tolist(),
-                        audio_emb=embeddings.audio[0].tolist(),
-                        description_emb=embeddings.description[0].tolist(),
-                    ))
-                finally:
-                    download_path.close()
-                    if clip_path:
-                        clip_path.close()
-            if len(video_metas) == num_videos:
+            bt.logging.info(f"Pre-screened thumbnails, {len(results)} candidates left in {time.time() - start:.3f} seconds")
+        except Exception as e:
+            bt.logging.warning(f"Error pre-screening thumbnails, keeping all candidates: {e}")
+    results = results[:num_candidates]
+    download_pool = ThreadPoolExecutor(max_workers=pipeline_config.download_workers)
+    clip_pool = ThreadPoolExecutor(max_workers=pipeline_config.clip_workers)
+    pending = {}  # future -> (stage, search result, embedding cache key)
+    stage_timings = {}  # future -> {"started_at": time the stage started running}
+    ready_clips = []
+
+    def submit(pool: ThreadPoolExecutor, stage: str, result: video_utils.YoutubeResult, key: Optional[str], func, *args):
+        timing = {}
+
+        def run_stage():
+            timing["started_at"] = time.time()
+            try:
+                return func(*args)
+            finally:
+                STAGE_TIMINGS.record(stage, time.time() - timing["started_at"])
+
+        future = pool.submit(run_stage)
+        pending[future] = (stage, result, key)
+        stage_timings[future] = timing
+
+    def drop_hopeless_candidates():
+        now = time.time()
+        for future, (stage, result, _) in list(pending.items()):
+            elapsed = now - stage_timings[future].get("started_at", now)
+            remaining = STAGE_TIMINGS.remaining(stage, elapsed, num_clips=1)
+            if now + remaining > deadline:
+                bt.logging.info(f"Dropping video {result.video_id}, it cannot finish {stage} before the deadline")
+                del pending[future]
+                if not future.cancel():
+                    future.add_done_callback(_close_when_done)
+
+    def stop_requested() -> bool:
+        if should_stop is not None and should_stop():
+            bt.logging.info(f"Stopping the search for '{query}' with {len(video_metas)} videos embedded")
+            return True
+        return False
+
+    try:
+        for result in results:
+            if len(video_metas) == num_videos or stop_requested():
+                break
+            key = None
+            if embedding_cache is not None:
+                key = candidate_cache_key(result, pipeline_config.embedding_version(imagebind))
+                cached = embedding_cache.get(key)
+                if cached is not None:
+                    cached.views = result.views
+                    video_metas.append(cached)
+                    bt.logging.info(f"Using cached embeddings for video {result.video_id}")
+                    continue
+            submit(download_pool, DOWNLOAD_STAGE, result, key, download_candidate, result, video_cache)
+
+        # take the first N that we need
+        first_ready_at = None
+        while (pending or ready_clips) and len(video_metas) < num_videos:
+            if stop_requested():
                 break
+            batch_size = min(pipeline_config.embed_batch_size, num_videos - len(video_metas))
+            if deadline is not None:
+                drop_hopeless_candidates()
+                if not pending and not ready_clips:
+                    break
+            if pending and len(ready_clips) < batch_size:
+                timeout = None
+                if first_ready_at is not None:
+                    timeout = max(0, first_ready_at + pipeline_config.embed_max_wait - time.time())
+                if deadline is not None:
+                    # wake up in time to embed whatever is ready before the deadline
+                    embed_by = deadline - STAGE_TIMINGS.remaining(EMBED_STAGE, 0, max(len(ready_clips), 1))
+                    deadline_timeout = max(0, embed_by - time.time())
+                    timeout = deadline_timeout if timeout is None else min(timeout, deadline_timeout)
+                if should_stop is not None:
+                    timeout = STOP_POLL_INTERVAL if timeout is None else min(timeout, STOP_POLL_INTERVAL)
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, result, key = pending.pop(future)
+                    try:
+                        output = future.result()
+                    except Exception as e:
+                        bt.logging.error(f"Error processing video {result.video_id}: {e}")
+                        continue
+                    if stage == DOWNLOAD_STAGE:
+                        if output:
+                            submit(
+                                clip_pool, CLIP_STAGE, result, key,
+                                clip_candidate, query, result, output, key, ffmpeg_executor,
+                                pipeline_config.single_pass_decode,
+                            )
+                    else:
+                        ready_clips.append(output)
+
+                if ready_clips and first_ready_at is None:
+                    first_ready_at = time.time()
+                out_of_time = (
+                    deadline is not None and
+                    time.time() + STAGE_TIMINGS.remaining(EMBED_STAGE, 0, max(len(ready_clips), 1)) >= deadline
+                )
+                # keep filling the batch until it is full, the oldest ready clip has waited long
+                # enough, or we are running out of time
+                if not ready_clips:
+                    if out_of_time:
+                        break
+                    continue
+                if (
+                    not out_of_time and pending and len(ready_clips) < batch_size and
+                    time.time() - first_ready_at < pipeline_config.embed_max_wait
+                ):
+                    continue
+
+            batch, ready_clips = ready_clips[:batch_size], ready_clips[batch_size:]
+            first_ready_at = time.time() if ready_clips else None
+            if deadline is not None and time.time() + STAGE_TIMINGS.remaining(EMBED_STAGE, 0, len(batch)) > deadline:
+                bt.logging.warning(f"Not enough time left to embed {len(batch)} more videos")
+                ready_clips = batch + ready_clips
+                break
+            try:
+                embed_start = time.time()
+                batch_metas = embed_clips(batch, imagebind)
+                STAGE_TIMINGS.record(EMBED_STAGE, (time.time() - embed_start) / len(batch))
+                video_metas.extend(batch_metas)
+                if embedding_cache is not None:
+                    clips_by_id = {clip.result.video_id: clip for clip in batch}
+                    for video_meta in batch_metas:
+                        embedding_cache.put(clips_by_id[video_meta.video_id].cache_key, video_meta)
+            finally:
+                for clip in batch:
+                    close_stage_output(clip)
 
     except Exception as e:
         bt.logging.error(f"Error searching for videos: {e}")
 
+    finally:
+        # drop whatever is still in flight, cleaning up temp files once workers finish with them
+        for future in pending:
+            if not future.cancel():
+                future.add_done_callback(_close_when_done)
+        for clip in ready_clips:
+            close_stage_output(clip)
+        download_pool.shutdown(wait=False)
+        clip_pool.shutdown(wait=False)
+        if embedding_cache is not None:
+            embedding_cache.flush()
+
     return video_metas
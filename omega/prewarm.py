@@ -0,0 +1,145 @@
+import random
+import threading
+import time
+from typing import List, Optional
+
+import bittensor as bt
+import requests
+
+from omega.augment import AbstractAugment, LOCAL_LLM_BATCH_SIZE
+from omega.embedding_cache import EmbeddingCache
+from omega.inventory import VideoInventory
+from omega.imagebind_wrapper import ImageBind
+from omega.job_engine import JobEngine
+from omega.miner_utils import search_and_embed_videos, PipelineConfig
+from omega.video_cache import VideoCache
+
+
+TOPICS_REQUEST_TIMEOUT = 10
+IDLE_POLL_INTERVAL = 1
+TOPIC_TIME_LIMIT = 120  # seconds spent pre-warming a single topic
+
+
+class TopicPrewarmer:
+    """
+    Background worker that pre-scrapes and pre-embeds videos for the validator API's topics while
+    the miner is idle. Embedded videos land in the embedding cache and, if one is given, in the
+    local inventory, so live requests for those topics are mostly answered without downloading
+    or embedding anything.
+
+    It only works while no live request is running (dropping the topic it is working on as soon
+    as one comes in), uses a single download / clip worker, and sleeps between topics so that it
+    is busy at most `duty_cycle` of the time.
+    """
+
+    def __init__(
+        self,
+        topics_url: str,
+        imagebind: ImageBind,
+        augment: AbstractAugment,
+        job_engine: JobEngine,
+        embedding_cache: EmbeddingCache,
+        video_cache: Optional[VideoCache] = None,
+        inventory: Optional[VideoInventory] = None,
+        max_inventory_size: int = 50000,
+        videos_per_topic: int = 4,
+        refresh_interval: float = 3600,
+        duty_cycle: float = 0.5,
+    ):
+        if not 0 < duty_cycle <= 1:
+            raise ValueError(f"The pre-warming duty cycle must be in (0, 1], got {duty_cycle}")
+        self.topics_url = topics_url
+        self.imagebind = imagebind
+        self.augment = augment
+        self.job_engine = job_engine
+        self.embedding_cache = embedding_cache
+        self.video_cache = video_cache
+        self.inventory = inventory
+        self.max_inventory_size = max_inventory_size
+        self.videos_per_topic = videos_per_topic
+        self.refresh_interval = refresh_interval
+        self.duty_cycle = duty_cycle
+        self.pipeline_config = PipelineConfig(download_workers=1, clip_workers=1)
+        self.should_exit = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.should_exit.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True, name="omega-prewarm")
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.should_exit.set()
+        if self.thread is not None:
+            self.thread.join(5)
+
+    def fetch_topics(self) -> List[str]:
+        response = requests.get(self.topics_url, timeout=TOPICS_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def should_yield(self) -> bool:
+        return self.job_engine.active_jobs > 0 or self.should_exit.is_set()
+
+    def wait_until_idle(self) -> None:
+        while self.job_engine.active_jobs > 0 and not self.should_exit.is_set():
+            self.should_exit.wait(IDLE_POLL_INTERVAL)
+
+    def inventory_is_full(self) -> bool:
+        # the embedding cache is an LRU cache that stays full once warm, so it never stops pre-warming
+        return self.inventory is not None and len(self.inventory) >= self.max_inventory_size
+
+    def prewarm_topic(self, topic: str) -> None:
+        start = time.time()
+        video_metadata = search_and_embed_videos(
+            self.augment(topic), self.videos_per_topic, self.imagebind,
+            self.pipeline_config, self.embedding_cache, self.video_cache,
+            deadline=start + TOPIC_TIME_LIMIT,
+            ffmpeg_executor=self.job_engine.process_pool,
+            should_stop=self.should_yield,
+        )
+        if self.inventory is not None:
+            self.inventory.add(video_metadata)
+        elapsed = time.time() - start
+        bt.logging.info(f"Pre-warmed {len(video_metadata)} videos for topic '{topic}' in {elapsed:.2f} seconds")
+        # stay within the duty cycle before picking up the next topic
+        self.should_exit.wait(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+
+    def preaugment(self, topics: List[str]) -> bool:
+        """
+        Augments the topics while idle, in small batches so a live request never waits long for
+        the augmenter. Augmentations are cached, so live requests for these topics skip generation.
+        Returns False if the pre-warmer is stopping.
+        """
+        for chunk_start in range(0, len(topics), LOCAL_LLM_BATCH_SIZE):
+            self.wait_until_idle()
+            if self.should_exit.is_set():
+                return False
+            self.augment.augment_batch(topics[chunk_start:chunk_start + LOCAL_LLM_BATCH_SIZE])
+        return True
+
+    def run(self) -> None:
+        while not self.should_exit.is_set():
+            cycle_start = time.time()
+            try:
+                topics = self.fetch_topics()
+            except Exception as e:
+                bt.logging.warning(f"Error fetching topics to pre-warm: {e}")
+                topics = []
+            random.shuffle(topics)
+            if not self.preaugment(topics):
+                return
+
+            for topic in topics:
+                self.wait_until_idle()
+                if self.should_exit.is_set():
+                    return
+                if self.inventory_is_full():
+                    bt.logging.info("Inventory is full, pausing pre-warming")
+                    break
+                try:
+                    self.prewarm_topic(topic)
+                except Exception as e:
+                    bt.logging.warning(f"Error pre-warming topic '{topic}': {e}")
+
+            self.should_exit.wait(max(self.refresh_interval - (time.time() - cycle_start), 0))
@@ -16,11 +16,39 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import base64
 import typing
 import json
 
 import bittensor as bt
-from pydantic import BaseModel
+import numpy as np
+from pydantic import BaseModel, root_validator
+
+
+# Embeddings are sent either as lists of floats, or as base64 encoded little-endian float16 /
+# float32 buffers, which are much smaller than decimal JSON and decode straight into numpy.
+LIST_ENCODING = "list"
+EMBEDDING_DTYPES = {"float16": "<f2", "float32": "<f4"}
+EMBEDDING_ENCODINGS = [LIST_ENCODING, *EMBEDDING_DTYPES]
+EMBEDDING_FIELDS = ["video_emb", "audio_emb", "description_emb"]
+EMBEDDING_DIM = 1024  # imagebind_huge output dimension
+
+
+def encode_embedding(embedding: typing.Sequence[float], encoding: str) -> typing.Union[typing.List[float], str]:
+    if encoding == LIST_ENCODING:
+        return np.asarray(embedding, dtype=np.float32).tolist()
+    if encoding not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unknown embedding encoding {encoding}, expected one of {EMBEDDING_ENCODINGS}")
+    return base64.b64encode(np.asarray(embedding, dtype=EMBEDDING_DTYPES[encoding]).tobytes()).decode("ascii")
+
+
+def decode_embedding(embedding: typing.Union[typing.List[float], str], encoding: str) -> np.ndarray:
+    """Decodes an embedding sent in either form into a float32 array."""
+    if not isinstance(embedding, str):
+        return np.asarray(embedding, dtype=np.float32)
+    if encoding not in EMBEDDING_DTYPES:
+        raise ValueError(f"Embedding is a string, but its encoding {encoding} is not one of {list(EMBEDDING_DTYPES)}")
+    return np.frombuffer(base64.b64decode(embedding), dtype=EMBEDDING_DTYPES[encoding]).astype(np.float32)
 
 
 class VideoMetadata(BaseModel):
@@ -32,9 +60,25 @@ class VideoMetadata(BaseModel):
     views: int
     start_time: int
     end_time: int
-    video_emb: typing.List[float]
-    audio_emb: typing.List[float]
-    description_emb: typing.List[float]
+    video_emb: typing.Union[typing.List[float], str]
+    audio_emb: typing.Union[typing.List[float], str]
+    description_emb: typing.Union[typing.List[float], str]
+    embedding_encoding: str = LIST_ENCODING  # how the three embeddings are encoded
+
+    @root_validator(skip_on_failure=True)
+    def check_embeddings(cls, values):
+        """Rejects malformed embeddings when the response is parsed rather than while scoring it."""
+        encoding = values["embedding_encoding"]
+        if encoding not in EMBEDDING_ENCODINGS:
+            raise ValueError(f"Unknown embedding encoding {encoding}, expected one of {EMBEDDING_ENCODINGS}")
+        for field in EMBEDDING_FIELDS:
+            try:
+                embedding = decode_embedding(values[field], encoding)
+            except ValueError as e:  # includes binascii.Error
+                raise ValueError(f"Could not decode {field}: {e}")
+            if embedding.shape != (EMBEDDING_DIM,):
+                raise ValueError(f"{field} has shape {embedding.shape}, expected ({EMBEDDING_DIM},)")
+        return values
 
     def __repr_args__(self):
         parent_args = super().__repr_args__()
@@ -44,6 +88,19 @@ class VideoMetadata(BaseModel):
             [(a, ["..."]) for a in exclude_args]
         )
 
+    def get_embedding(self, field: str) -> np.ndarray:
+        """The embedding in `field` (one of EMBEDDING_FIELDS) as a float32 array, however it was sent."""
+        return decode_embedding(getattr(self, field), self.embedding_encoding)
+
+    def encode_embeddings(self, encoding: str) -> "VideoMetadata":
+        """A copy of this metadata with its embeddings in the given encoding."""
+        if encoding == self.embedding_encoding:
+            return self
+        return self.copy(update={
+            **{field: encode_embedding(self.get_embedding(field), encoding) for field in EMBEDDING_FIELDS},
+            "embedding_encoding": encoding,
+        })
+
 
 class Videos(bt.Synapse):
     """
@@ -67,7 +124,7 @@ class Videos(bt.Synapse):
         """
         Dumps the Videos object to a serializable dict, but makes sure to use input properties from
         the input_synapse, while taking the non-null output property video_metadata from the
-        response (self).
+        response (self). Embeddings are passed on in whichever encoding the miner sent them.
         """
         json_str = Videos(
             query=input_synapse.query,
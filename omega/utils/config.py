@@ -23,6 +23,8 @@ import bittensor as bt
 from loguru import logger
 from enum import Enum
 
+from omega.protocol import EMBEDDING_ENCODINGS, LIST_ENCODING
+
 
 def check_config(cls, config: "bt.Config"):
     r"""Checks/validates the config namespace object."""
@@ -145,6 +147,210 @@ def add_miner_args(cls, parser):
         default=QueryAugment.LocalLLMAugment.value,
     )
 
+    parser.add_argument(
+        "--neuron.augment_latency_budget",
+        type=float,
+        help="Seconds an OpenAIAugment completion may take before the raw query is used instead.",
+        default=5.0,
+    )
+
+    parser.add_argument(
+        "--neuron.augment_hedge_percentile",
+        type=float,
+        help="If set (0-1), OpenAIAugment sends a second request once the first is slower than this percentile of recent latencies. Set to 0 to disable.",
+        default=0,
+    )
+
+    parser.add_argument(
+        "--neuron.max_concurrent_requests",
+        type=int,
+        help="Number of validator requests processed in parallel. Additional requests wait for a free slot.",
+        default=2,
+    )
+
+    parser.add_argument(
+        "--neuron.ffmpeg_workers",
+        type=int,
+        help="Number of worker processes for ffprobe / ffmpeg clipping, started with the miner. Each one re-imports the miner and its models, and ffmpeg already runs in its own process, so by default (0) they run in threads instead.",
+        default=0,
+    )
+
+    parser.add_argument(
+        "--neuron.embedding_encoding",
+        type=str,
+        choices=EMBEDDING_ENCODINGS,
+        help="How embeddings are sent to validators: lists of floats, or compact base64 float16 / float32 buffers. Only use the compact encodings with validators that accept them.",
+        default=LIST_ENCODING,
+    )
+
+    parser.add_argument(
+        "--neuron.result_cache_ttl",
+        type=float,
+        help="Seconds to keep complete responses for repeated (query, num_videos) requests. Set to 0 to disable.",
+        default=60,
+    )
+
+    parser.add_argument(
+        "--neuron.download_workers",
+        type=int,
+        help="Number of candidate videos to download concurrently for each request.",
+        default=4,
+    )
+
+    parser.add_argument(
+        "--neuron.clip_workers",
+        type=int,
+        help="Number of downloaded videos to probe and clip concurrently for each request.",
+        default=2,
+    )
+
+    parser.add_argument(
+        "--neuron.prerank_multiplier",
+        type=float,
+        help="Search this many times the requested videos and only download the ones whose title / description best match the query. Set to 0 to download in search order.",
+        default=3.0,
+    )
+
+    parser.add_argument(
+        "--neuron.thumbnail_prescreen",
+        action="store_true",
+        help="If set, embed each candidate's thumbnail and skip downloading videos whose thumbnail does not match the query.",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--neuron.thumbnail_min_score",
+        type=float,
+        help="Minimum cosine similarity between the query and a candidate's thumbnail for it to be downloaded.",
+        default=0.1,
+    )
+
+    parser.add_argument(
+        "--neuron.single_pass_decode",
+        action="store_true",
+        help="If set, decode the sampled frames and audio of each clip in memory in a single ffmpeg pass instead of through clip and audio temp files. Faster, but frames are scaled and audio is resampled by ffmpeg, so the embeddings differ slightly from the ones validators compute; check them with validator-api/check_imagebind_accuracy.py --candidate single_pass first.",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--neuron.sparse_video_sampling",
+        action="store_true",
+        help="If set, decode only the video frames ImageBind samples, resized by the decoder. Faster, but the video embeddings differ slightly from the ones validators compute; check them with validator-api/check_imagebind_accuracy.py --candidate sparse first.",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--neuron.snap_to_keyframes",
+        action="store_true",
+        help="If set (with --neuron.sparse_video_sampling), sampled video frames that are close to a keyframe are replaced by the keyframe, which is faster to decode.",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--neuron.imagebind_workers",
+        type=int,
+        help="Run ImageBind on CPU in this many worker processes that share one copy of the weights, each pinned to its own cores. Set to 0 to run it in the miner process.",
+        default=0,
+    )
+
+    parser.add_argument(
+        "--neuron.embed_batch_size",
+        type=int,
+        help="Maximum number of clips to embed in a single ImageBind forward pass.",
+        default=8,
+    )
+
+    parser.add_argument(
+        "--neuron.embed_max_wait",
+        type=float,
+        help="Maximum seconds a ready clip waits for its embedding batch to fill before it is flushed.",
+        default=2.0,
+    )
+
+    parser.add_argument(
+        "--neuron.deadline_margin",
+        type=float,
+        help="Seconds before the validator's timeout by which a response must be ready. Work that cannot finish in time is dropped.",
+        default=5.0,
+    )
+
+    parser.add_argument(
+        "--neuron.embedding_cache_dir",
+        type=str,
+        help="Directory for the persistent cache of video, audio and description embeddings. Defaults to embedding_cache in the neuron's directory. Each miner needs its own.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--neuron.embedding_cache_gb",
+        type=float,
+        help="Disk budget for the embedding cache in GB. Set to 0 to disable the cache.",
+        default=1.0,
+    )
+
+    parser.add_argument(
+        "--neuron.video_cache_dir",
+        type=str,
+        help="Directory for the local cache of downloaded videos. Defaults to video_cache in the neuron's directory. Each miner needs its own.",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--neuron.video_cache_gb",
+        type=float,
+        help="Disk budget for the downloaded video cache in GB. Set to 0 to disable the cache.",
+        default=2.0,
+    )
+
+    parser.add_argument(
+        "--neuron.prewarm",
+        action="store_true",
+        help="If set, pre-scrape and pre-embed videos for the validator API's topics while the miner is idle.",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--neuron.prewarm_videos_per_topic",
+        type=int,
+        help="Number of videos to pre-embed per topic in each pre-warming round.",
+        default=4,
+    )
+
+    parser.add_argument(
+        "--neuron.prewarm_interval",
+        type=float,
+        help="Seconds between pre-warming rounds over the topic list.",
+        default=3600,
+    )
+
+    parser.add_argument(
+        "--neuron.prewarm_duty_cycle",
+        type=float,
+        help="Maximum fraction of idle time spent pre-warming (0-1].",
+        default=0.5,
+    )
+
+    parser.add_argument(
+        "--neuron.inventory_dir",
+        type=str,
+        help="Directory for the local inventory of pre-embedded clips (filled by pre-warming).",
+        default="~/.cache/omega/inventory",
+    )
+
+    parser.add_argument(
+        "--neuron.inventory_max_size",
+        type=int,
+        help="Maximum number of clips pre-warming keeps in the local inventory.",
+        default=50000,
+    )
+
+    parser.add_argument(
+        "--neuron.inventory_min_score",
+        type=float,
+        help="Minimum cosine similarity between the query and a clip for it to be answered from the inventory.",
+        default=0.2,
+    )
+
     parser.add_argument(
         "--blacklist.force_validator_permit",
         action="store_true",
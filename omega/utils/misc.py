@@ -16,11 +16,16 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
 
+import os
 import time
 import math
+import fcntl
+import threading
 import hashlib as rpccheckhealth
+from collections import OrderedDict
+from concurrent.futures import Future
 from math import floor
-from typing import Callable, Any
+from typing import Callable, Any, Hashable, Optional
 from functools import lru_cache, update_wrapper
 
 
@@ -70,6 +75,116 @@ def ttl_cache(maxsize: int = 128, typed: bool = False, ttl: int = -1):
     return wrapper
 
 
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache with an optional time-to-live for each entry.
+
+    Unlike `ttl_cache`, entries expire `ttl` seconds after they were inserted (rather than at
+    fixed time buckets), and values can be inserted explicitly, e.g. only when a call succeeded.
+
+    Args:
+        maxsize (int): Maximum number of entries. The least recently used entry is evicted beyond this.
+        ttl (float, optional): Seconds an entry stays valid after insertion. None means no expiry.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def items(self) -> list:
+        """Unexpired (key, value) pairs, least recently used first."""
+        now = time.time()
+        with self.lock:
+            return [
+                (key, value) for key, (expires_at, value) in self.entries.items()
+                if expires_at is None or expires_at >= now
+            ]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class InFlight:
+    """
+    Collapses concurrent calls that share a key into a single call. The first caller runs the
+    function, and every caller that arrives with the same key while it is still running waits
+    for it and receives the same result (or exception).
+
+    Example:
+        in_flight = InFlight()
+        result = in_flight.run(("query", 8), expensive_search, "query", 8)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def run(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        with self.lock:
+            future = self.futures.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.futures[key] = future
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.futures[key]
+
+
+def lock_directory(path: str) -> int:
+    """
+    Takes an exclusive lock on the directory `path` for the lifetime of this process, so that two
+    processes never share one on-disk cache. Returns the locked file descriptor.
+
+    Raises:
+        RuntimeError: If another process already holds the lock.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        raise RuntimeError(f"{path} is in use by another process, give each process its own directory")
+    return fd
+
+
 def _ttl_hash_gen(seconds: int):
     """
     Internal generator function used by the `ttl_cache` decorator to generate a new hash value at regular
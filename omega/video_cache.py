@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Optional
+
+import bittensor as bt
+
+from omega import video_utils
+from omega.utils.misc import lock_directory
+
+
+INDEX_FILENAME = "index.json"
+
+
+class VideoCache:
+    """
+    Local cache of downloaded video ranges, keyed by video id and range.
+
+    A request for a range is served from any cached range of the same video that contains it,
+    by stream-copying the requested part out of the cached file. Entries are evicted in LRU
+    order once the total size of the cached files exceeds the disk budget. Only one process can
+    open a cache directory at a time.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()  # filename -> {"video_id", "start", "end", "size"}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # the index and the disk budget are only enforced within one process
+        self.lock_fd = lock_directory(self.cache_dir)
+        self._load_index()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.cache_dir, INDEX_FILENAME)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            bt.logging.warning(f"Ignoring unreadable video cache index {self.index_path}: {e}")
+            return
+        for filename, entry in entries:
+            if os.path.exists(os.path.join(self.cache_dir, filename)):
+                self.entries[filename] = entry
+        self._evict()
+        bt.logging.info(f"Loaded {len(self.entries)} cached videos from {self.cache_dir}")
+
+    def _save_index(self) -> None:
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(tmp_path, self.index_path)
+
+    def _remove(self, filename: str) -> None:
+        del self.entries[filename]
+        try:
+            os.remove(os.path.join(self.cache_dir, filename))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        total = self.nbytes
+        while self.entries and total > self.max_bytes:
+            filename, entry = next(iter(self.entries.items()))
+            total -= entry["size"]
+            self._remove(filename)
+
+    def _find(self, video_id: str, start: int, end: int) -> Optional[str]:
+        for filename, entry in self.entries.items():
+            if entry["video_id"] == video_id and entry["start"] <= start and end <= entry["end"]:
+                return filename
+        return None
+
+    def get(self, video_id: str, start: int, end: int) -> Optional[BinaryIO]:
+        """
+        Returns a temp file holding [start, end] of the video if a cached range covers it.
+        """
+        with self.lock:
+            filename = self._find(video_id, start, end)
+            if filename is None:
+                return None
+            self.entries.move_to_end(filename)
+            offset = self.entries[filename]["start"]
+        try:
+            return video_utils.clip_video(os.path.join(self.cache_dir, filename), start - offset, end - offset)
+        except Exception as e:
+            # the entry may have been evicted while we were clipping it
+            bt.logging.warning(f"Error reading video {video_id} from cache: {e}")
+            return None
+
+    def put(self, video_id: str, start: int, end: int, video_path: str) -> None:
+        filename = f"{video_id}_{start}_{end}.mp4"
+        cache_path = os.path.join(self.cache_dir, filename)
+        size = os.stat(video_path).st_size
+        if size > self.max_bytes:
+            return
+        try:
+            try:
+                # hard links keep the data alive after the caller deletes its temp file
+                os.link(video_path, f"{cache_path}.tmp")
+            except OSError:
+                shutil.copyfile(video_path, f"{cache_path}.tmp")
+            os.replace(f"{cache_path}.tmp", cache_path)
+        except OSError as e:
+            bt.logging.warning(f"Error adding video {video_id} to cache: {e}")
+            return
+
+        with self.lock:
+            # ranges of the same video contained in the new one are now redundant
+            for other, entry in list(self.entries.items()):
+                if (
+                    other != filename and entry["video_id"] == video_id and
+                    start <= entry["start"] and entry["end"] <= end
+                ):
+                    self._remove(other)
+            self.entries[filename] = {"video_id": video_id, "start": start, "end": end, "size": size}
+            self.entries.move_to_end(filename)
+            self._evict()
+            self._save_index()
@@ -1,13 +1,27 @@
 import os
 import tempfile
-from typing import Optional, BinaryIO
+from concurrent.futures import Executor
+from typing import Optional, BinaryIO, TYPE_CHECKING
 
 import bittensor as bt
 import ffmpeg
 from pydantic import BaseModel
+import requests
 from yt_dlp import YoutubeDL
 
 from omega.constants import FIVE_MINUTES
+from omega.utils.misc import LRUCache, InFlight
+
+if TYPE_CHECKING:
+    from omega.video_cache import VideoCache
+
+
+SEARCH_CACHE_TTL = 300  # 5 minutes
+SEARCH_CACHE_SIZE = 256
+SEARCH_CACHE = LRUCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+SEARCHES_IN_FLIGHT = InFlight()
+THUMBNAIL_URL = "https://i.ytimg.com/vi/{video_id}/hqdefault.jpg"
+THUMBNAIL_TIMEOUT = 5
 
 
 def seconds_to_str(seconds):
@@ -17,18 +31,44 @@ def seconds_to_str(seconds):
     return f"{hours:02}:{minutes:02}:{seconds:02}"
 
 
-def clip_video(video_path: str, start: int, end: int) -> Optional[BinaryIO]:
-    temp_fileobj = tempfile.NamedTemporaryFile(suffix=".mp4")
+def clip_video_to(video_path: str, start: int, end: int, output_path: str) -> None:
     (
         ffmpeg
         .input(video_path, ss=seconds_to_str(start), to=seconds_to_str(end))
-        .output(temp_fileobj.name, c="copy")  # copy flag prevents decoding and re-encoding
+        .output(output_path, c="copy")  # copy flag prevents decoding and re-encoding
         .overwrite_output()
         .run(quiet=True)
     )
+
+
+def clip_video(video_path: str, start: int, end: int, executor: Optional[Executor] = None) -> Optional[BinaryIO]:
+    """
+    Stream-copies [start, end] of the video into a temp file. The ffmpeg call runs on `executor`
+    (e.g. a process pool) if one is given.
+    """
+    temp_fileobj = tempfile.NamedTemporaryFile(suffix=".mp4")
+    try:
+        if executor is None:
+            clip_video_to(video_path, start, end, temp_fileobj.name)
+        else:
+            executor.submit(clip_video_to, video_path, start, end, temp_fileobj.name).result()
+    except Exception:
+        temp_fileobj.close()
+        raise
     return temp_fileobj
 
 
+def fetch_thumbnail(video_id: str) -> Optional[bytes]:
+    """Returns the JPEG bytes of the video's YouTube thumbnail, or None if it is unavailable."""
+    try:
+        response = requests.get(THUMBNAIL_URL.format(video_id=video_id), timeout=THUMBNAIL_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    except requests.RequestException as e:
+        bt.logging.debug(f"Error fetching thumbnail for video {video_id}: {e}")
+        return None
+
+
 def skip_live(info_dict):
     """
     function to skip downloading if it's a live video (yt_dlp doesn't respect the 20 minute 
@@ -47,7 +87,7 @@ class YoutubeResult(BaseModel):
     views: int
 
 
-def search_videos(query, max_results=8):
+def search_youtube(query, max_results=8):
     videos = []
     ydl_opts = {
         "format": "worst",
@@ -77,6 +117,26 @@ def search_videos(query, max_results=8):
     return videos
 
 
+def _search_and_cache(query, max_results):
+    videos = search_youtube(query, max_results)
+    if videos:  # don't cache failed searches
+        SEARCH_CACHE.put((query, max_results), videos)
+    return videos
+
+
+def search_videos(query, max_results=8):
+    """
+    Search YouTube for `query`. Results are cached for SEARCH_CACHE_TTL seconds, and concurrent
+    identical searches share a single in-flight extraction.
+    """
+    key = (query, max_results)
+    videos = SEARCH_CACHE.get(key)
+    if videos is None:
+        videos = SEARCHES_IN_FLIGHT.run(key, _search_and_cache, query, max_results)
+    # callers mutate results (e.g. correcting the length), so hand out copies
+    return [video.copy() for video in videos]
+
+
 def get_video_duration(filename: str) -> int:
     metadata = ffmpeg.probe(filename)
     video_stream = next((stream for stream in metadata['streams'] if stream['codec_type'] == 'video'), None)
@@ -99,11 +159,18 @@ def is_valid_id(youtube_id: str) -> bool:
 
 
 def download_video(
-    video_id: str, start: Optional[int]=None, end: Optional[int]=None, proxy: Optional[str]=None
+    video_id: str, start: Optional[int]=None, end: Optional[int]=None, proxy: Optional[str]=None,
+    cache: Optional["VideoCache"]=None,
 ) -> Optional[BinaryIO]:
     if not is_valid_id(video_id):
         raise FakeVideoException(f"Invalid video ID: {video_id}")
 
+    use_cache = cache is not None and start is not None and end is not None
+    if use_cache:
+        cached_video = cache.get(video_id, start, end)
+        if cached_video is not None:
+            return cached_video
+
     video_url = f"https://www.youtube.com/watch?v={video_id}"
     
     temp_fileobj = tempfile.NamedTemporaryFile(suffix=".mp4")
@@ -132,6 +199,9 @@ def download_video(
             temp_fileobj.close()
             return None
 
+        if use_cache:
+            cache.put(video_id, start, end, temp_fileobj.name)
+
         return temp_fileobj
     except Exception as e:
         temp_fileobj.close()
@@ -0,0 +1,123 @@
+"""
+Checks the deadline handling of OpenAIAugment.augment_async against a local stand-in for the
+OpenAI chat completions API, so no API key or network access is needed.
+
+The stand-in server answers each request after a scripted delay. We check that
+- a completion slower than the latency budget falls back to the raw query within the budget, and
+- once a request runs longer than the hedging percentile of recent latencies, a hedged request
+  is sent and its (faster) answer is used.
+
+Usage:
+    python scripts/check_openai_augment.py
+"""
+import asyncio
+import collections
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from omega import augment
+
+
+SERVER_ADDRESS = ("127.0.0.1", 0)  # any free port
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """Answers chat completions after the next scripted delay, numbering the requests it receives."""
+
+    def __init__(self):
+        super().__init__(SERVER_ADDRESS, StandInHandler)
+        self.delays = collections.deque()
+        self.lock = threading.Lock()
+        self.num_requests = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def next_request(self):
+        with self.lock:
+            self.num_requests += 1
+            return self.num_requests, self.delays.popleft() if self.delays else 0
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        request_number, delay = self.server.next_request()
+        time.sleep(delay)
+        body = json.dumps({
+            "id": f"stand-in-{request_number}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": augment.OPENAI_MODEL,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": f"answer of request {request_number}"},
+                "finish_reason": "stop",
+            }],
+        }).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up on this request
+
+    def log_message(self, *args):
+        pass
+
+
+async def check_budget_fallback(server: StandInServer) -> bool:
+    augmenter = augment.OpenAIAugment(latency_budget=0.5)
+    server.delays.extend([2.0])
+    start = time.time()
+    new_query = await augmenter.augment_async("budget fallback query")
+    elapsed = time.time() - start
+    passed = new_query == "budget fallback query" and elapsed < 1.0
+    print(f"Budget fallback: '{new_query}' after {elapsed:.2f}s: {'pass' if passed else 'FAIL'}")
+    return passed
+
+
+async def check_hedged_request(server: StandInServer) -> bool:
+    augmenter = augment.OpenAIAugment(latency_budget=5.0, hedge_percentile=0.9)
+    augmenter.latencies.extend([0.1] * augment.OPENAI_MIN_LATENCY_SAMPLES)
+    # the first request stalls, the hedged one sent after 0.1s answers straight away
+    server.delays.extend([3.0, 0.0])
+    first_request = server.num_requests + 1
+    start = time.time()
+    new_query = await augmenter.augment_async("hedged query")
+    elapsed = time.time() - start
+    passed = new_query == f"answer of request {first_request + 1}" and elapsed < 1.0
+    print(f"Hedged request: '{new_query}' after {elapsed:.2f}s: {'pass' if passed else 'FAIL'}")
+    return passed
+
+
+async def run_checks(server: StandInServer) -> bool:
+    return all([await check_budget_fallback(server), await check_hedged_request(server)])
+
+
+def main() -> int:
+    server = StandInServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # the clients read these when they are created
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # keep the stand-in's answers out of the real augmented query cache
+        augment.AUGMENT_CACHE = augment.AugmentCache(os.path.join(cache_dir, "augmented_queries.json"))
+        try:
+            passed = asyncio.run(run_checks(server))
+        finally:
+            server.shutdown()
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
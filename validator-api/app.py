@@ -13,10 +13,15 @@ from starlette import status
 from substrateinterface import Keypair
 
 from omega.protocol import Videos
-from omega.imagebind_wrapper import ImageBind
+from omega.imagebind_wrapper import ImageBind, ModalityType
+from omega.imagebind_pool import ImageBindPool
+from omega.inference_scheduler import InferenceScheduler
 
 from validator_api import score
-from validator_api.config import TOPICS_LIST, IS_PROD
+from validator_api.config import (
+    TOPICS_LIST, IS_PROD, IMAGEBIND_QUANTIZE, IMAGEBIND_NUM_THREADS, IMAGEBIND_BACKEND, IMAGEBIND_IDLE_TIMEOUT,
+    INFERENCE_BATCH_WAIT, IMAGEBIND_WORKERS,
+)
 from validator_api.dataset_upload import dataset_uploader
 
 
@@ -25,7 +30,21 @@ NETUID = int(os.environ["NETUID"])
 
 
 security = HTTPBasic()
-imagebind = ImageBind()
+if IMAGEBIND_WORKERS > 0:
+    # CPU worker processes sharing one copy of the weights, which all have to be loaded up front
+    imagebind = ImageBindPool(
+        ImageBind(quantize=IMAGEBIND_QUANTIZE, backend=IMAGEBIND_BACKEND),
+        IMAGEBIND_WORKERS,
+    )
+else:
+    # most requests only embed text (queries and description-only checks), vision and audio are loaded on first use
+    imagebind = InferenceScheduler(ImageBind(
+        quantize=IMAGEBIND_QUANTIZE,
+        num_threads=IMAGEBIND_NUM_THREADS,
+        backend=IMAGEBIND_BACKEND,
+        modalities=[ModalityType.TEXT],
+        idle_timeout=IMAGEBIND_IDLE_TIMEOUT or None,
+    ), max_wait=INFERENCE_BATCH_WAIT)
 
 
 def get_hotkey(credentials: Annotated[HTTPBasicCredentials, Depends(security)]) -> str:
@@ -107,6 +126,10 @@ async def main():
     async def get_topics() -> List[str]:
         return TOPICS_LIST
 
+    @app.get("/api/inference_metrics")
+    async def get_inference_metrics() -> dict:
+        return imagebind.metrics()
+
     @app.get("/")
     def healthcheck():
         return datetime.utcnow()
@@ -0,0 +1,141 @@
+"""
+Checks that a CPU-optimized ImageBind (the dynamically int8 quantized model, the ONNX Runtime
+backend, decoding only the sampled video frames, or decoding each clip in a single ffmpeg pass
+for `embed_media`) agrees with the fp32 PyTorch model and ImageBind's own video loader closely
+enough for `is_similar` checks at SIMILARITY_THRESHOLD to keep passing.
+
+Validators embed with the fp32 model and ImageBind's video loader, so for a number of real
+videos we compare the embeddings the candidate computes against the fp32 ones, exactly like
+`random_check` would, and report the cosine similarity per modality and the fraction of videos
+that pass. With --tolerance, every
+embedding must also be within that cosine distance of the fp32 one (a parity check, e.g. for
+the ONNX backend, which should match fp32 up to numerical noise).
+
+Usage:
+    python check_imagebind_accuracy.py --candidate int8 --num_videos 4 --queries "minecraft gameplay footage"
+    python check_imagebind_accuracy.py --candidate onnx --tolerance 1e-4
+    python check_imagebind_accuracy.py --candidate sparse
+    python check_imagebind_accuracy.py --candidate single_pass
+"""
+import argparse
+import sys
+from typing import List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from omega import media_decode, video_utils
+from omega.constants import FIVE_MINUTES, SIMILARITY_THRESHOLD
+from omega.imagebind_wrapper import ImageBind, ONNX_BACKEND, is_similar
+from omega.miner_utils import get_description, get_relevant_timestamps
+
+
+SINGLE_PASS_CANDIDATE = "single_pass"
+CANDIDATES = {
+    "int8": dict(quantize=True),
+    "onnx": dict(backend=ONNX_BACKEND),
+    "sparse": dict(sparse_video_sampling=True),
+    SINGLE_PASS_CANDIDATE: dict(),  # the fp32 model, fed by media_decode.decode_media
+}
+DEFAULT_QUERIES = [
+    "minecraft gameplay footage",
+    "street food market in bangkok",
+    "acoustic guitar cover",
+    "formula 1 race highlights",
+]
+
+
+def compare(name: str, reference: torch.Tensor, candidate: torch.Tensor, results: dict) -> bool:
+    reference, candidate = reference.float().cpu(), candidate.float().cpu()
+    similarity = F.cosine_similarity(candidate, reference).item()
+    passed = bool(is_similar(candidate, reference[0].numpy()))
+    results.setdefault(name, []).append((similarity, passed))
+    return passed
+
+
+def summarize(results: dict) -> None:
+    print(f"\nAgreement with fp32 PyTorch (is_similar threshold {SIMILARITY_THRESHOLD}):")
+    for name, values in results.items():
+        similarities = [similarity for similarity, _ in values]
+        pass_rate = sum(passed for _, passed in values) / len(values)
+        print(
+            f"  {name:<12} n={len(values):<4} mean cosine={sum(similarities) / len(similarities):.5f} "
+            f"min cosine={min(similarities):.5f} pass rate={pass_rate:.2%}"
+        )
+
+
+def main(
+    candidate_name: str, queries: List[str], num_videos: int, num_threads: int, min_pass_rate: float,
+    tolerance: Optional[float],
+) -> int:
+    fp32 = ImageBind()
+    candidate_model = ImageBind(num_threads=num_threads or None, **CANDIDATES[candidate_name])
+    results = {}
+    video_checks = []
+
+    for query in queries:
+        compare("query text", fp32.embed_text([query]), candidate_model.embed_text([query]), results)
+        num_checked = len(video_checks)
+        for result in video_utils.search_videos(query, max_results=num_videos * 2):
+            if len(video_checks) - num_checked >= num_videos:
+                break
+            download = video_utils.download_video(result.video_id, 0, min(result.length, FIVE_MINUTES))
+            if download is None:
+                continue
+            try:
+                result.length = video_utils.get_video_duration(download.name)
+                start, end = get_relevant_timestamps(query, result, download)
+                description = get_description(result, download)
+                # the miner decodes the downloaded video directly, without clipping it first
+                media = (
+                    media_decode.decode_media(download.name, start, end)
+                    if candidate_name == SINGLE_PASS_CANDIDATE else None
+                )
+                clip = video_utils.clip_video(download.name, start, end)
+            finally:
+                download.close()
+            try:
+                reference = fp32.embed([description], [clip])
+                if media is not None:
+                    candidate = candidate_model.embed_media([description], [media])
+                else:
+                    candidate = candidate_model.embed([description], [clip])
+            except Exception as e:
+                print(f"Skipping video {result.video_id}: {e}")
+                continue
+            finally:
+                clip.close()
+            video_checks.append(all([
+                compare("video", reference.video, candidate.video, results),
+                compare("audio", reference.audio, candidate.audio, results),
+                compare("description", reference.description, candidate.description, results),
+            ]))
+            print(f"Checked video {result.video_id} for query '{query}': {'pass' if video_checks[-1] else 'FAIL'}")
+
+    summarize(results)
+    if not video_checks:
+        print("No videos could be checked")
+        return 1
+    pass_rate = sum(video_checks) / len(video_checks)
+    print(f"\n{sum(video_checks)}/{len(video_checks)} videos pass random_check with the {candidate_name} model ({pass_rate:.2%})")
+    if tolerance is not None:
+        min_similarity = min(similarity for values in results.values() for similarity, _ in values)
+        within_tolerance = 1 - min_similarity <= tolerance
+        print(f"Largest cosine distance to fp32: {1 - min_similarity:.2e} ({'within' if within_tolerance else 'OUTSIDE'} tolerance {tolerance:.0e})")
+        if not within_tolerance:
+            return 1
+    return 0 if pass_rate >= min_pass_rate else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidate", choices=list(CANDIDATES), default="int8", help="Model to compare against fp32 PyTorch.")
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERIES)
+    parser.add_argument("--num_videos", type=int, default=4, help="Videos to check per query.")
+    parser.add_argument("--num_threads", type=int, default=0, help="Intra-op threads for the candidate model.")
+    parser.add_argument("--min_pass_rate", type=float, default=1.0, help="Exit with an error below this pass rate.")
+    parser.add_argument("--tolerance", type=float, default=None, help="Maximum cosine distance to fp32 for any embedding.")
+    args = parser.parse_args()
+    sys.exit(main(
+        args.candidate, args.queries, args.num_videos, args.num_threads, args.min_pass_rate, args.tolerance,
+    ))
@@ -21,3 +21,11 @@ PROXY_LIST = parse_proxies(json.loads(os.environ["PROXY_LIST"]))
 IS_PROD = os.environ.get("IS_PROD", "false").lower() == "true"
 CHECK_PROBABILITY = float(os.environ.get("CHECK_PROBABILITY", 0.1))
 UPLOAD_BATCH_SIZE = int(os.environ.get("UPLOAD_BATCH_SIZE", 1024))
+VIDEO_CACHE_DIR = os.environ.get("VIDEO_CACHE_DIR", "~/.cache/omega/validator_api/videos")
+VIDEO_CACHE_GB = float(os.environ.get("VIDEO_CACHE_GB", 2))
+IMAGEBIND_QUANTIZE = os.environ.get("IMAGEBIND_QUANTIZE", "false").lower() == "true"
+IMAGEBIND_NUM_THREADS = int(os.environ.get("IMAGEBIND_NUM_THREADS", 0))
+IMAGEBIND_BACKEND = os.environ.get("IMAGEBIND_BACKEND", "torch")
+IMAGEBIND_IDLE_TIMEOUT = float(os.environ.get("IMAGEBIND_IDLE_TIMEOUT", 0))
+INFERENCE_BATCH_WAIT = float(os.environ.get("INFERENCE_BATCH_WAIT", 0.02))
+IMAGEBIND_WORKERS = int(os.environ.get("IMAGEBIND_WORKERS", 0))
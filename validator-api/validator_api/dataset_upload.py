@@ -38,9 +38,10 @@ class DatasetUploader:
                 "views": video.views,
                 "start_time": video.start_time,
                 "end_time": video.end_time,
-                "video_embed": video.video_emb,
-                "audio_embed": video.audio_emb,
-                "description_embed": video.description_emb,
+                # miners may send the embeddings base64 encoded, the dataset always has lists of floats
+                "video_embed": video.get_embedding("video_emb").tolist(),
+                "audio_embed": video.get_embedding("audio_emb").tolist(),
+                "description_embed": video.get_embedding("description_emb").tolist(),
                 "description_relevance_score": desc_score,
                 "query_relevance_score": query_score,
                 "query": query,
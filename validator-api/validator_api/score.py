@@ -3,27 +3,31 @@ import random
 import uuid
 from typing import List, Tuple, Optional, BinaryIO
 
+import numpy as np
 from pinecone import Pinecone
 import torch
 import torch.nn.functional as F
 
 from omega.protocol import Videos, VideoMetadata
 from omega import video_utils
-from omega.constants import MAX_VIDEO_LENGTH, MIN_VIDEO_LENGTH
-from omega.imagebind_wrapper import ImageBind, Embeddings, run_async
+from omega.video_cache import VideoCache
+from omega.constants import DIFFERENCE_THRESHOLD, MAX_VIDEO_LENGTH, MIN_VIDEO_LENGTH
+from omega.imagebind_wrapper import Embeddings, is_similar, run_async
+from omega.inference_scheduler import InferenceScheduler
 
 from validator_api import config
 from validator_api.dataset_upload import dataset_uploader
 
 
 PINECONE_INDEX = Pinecone(api_key=config.PINECONE_API_KEY).Index(config.PINECONE_INDEX)
-DIFFERENCE_THRESHOLD = 0.05
-SIMILARITY_THRESHOLD = 1 - DIFFERENCE_THRESHOLD
-GPU_SEMAPHORE = asyncio.Semaphore(1)
 DOWNLOAD_SEMAPHORE = asyncio.Semaphore(5)
 VIDEO_DOWNLOAD_TIMEOUT = 10
 MIN_SCORE = 0.005
 FAKE_VIDEO_PUNISHMENT = -5.0
+VIDEO_CACHE = (
+    VideoCache(config.VIDEO_CACHE_DIR, max_bytes=int(config.VIDEO_CACHE_GB * 1024 ** 3))
+    if config.VIDEO_CACHE_GB > 0 else None
+)
 
 
 async def query_pinecone(vector: List[float], top_k: int, select_idx: int) -> float:
@@ -87,11 +91,13 @@ def filter_embeddings(embeddings: Embeddings, is_too_similar: List[bool]) -> Emb
     return embeddings
 
 
-def is_similar(emb_1: torch.Tensor, emb_2: List[float]) -> bool:
-    return F.cosine_similarity(
-        emb_1,
-        torch.tensor(emb_2, device=emb_1.device).unsqueeze(0)
-    ) > SIMILARITY_THRESHOLD
+def stack_embeddings(metadata: List[VideoMetadata], device: str = "cpu") -> Embeddings:
+    """Stacks the embeddings of the videos, which miners send either as lists of floats or base64 encoded."""
+    return Embeddings(
+        video=torch.from_numpy(np.stack([v.get_embedding("video_emb") for v in metadata])).to(device),
+        audio=torch.from_numpy(np.stack([v.get_embedding("audio_emb") for v in metadata])).to(device),
+        description=torch.from_numpy(np.stack([v.get_embedding("description_emb") for v in metadata])).to(device),
+    )
 
 
 def metadata_check(metadata: List[VideoMetadata]) -> List[VideoMetadata]:
@@ -126,6 +132,7 @@ async def get_random_video(metadata: List[VideoMetadata], check_video: bool) ->
                     random_metadata.start_time,
                     random_metadata.end_time,
                     proxy=get_proxy_url(),
+                    cache=VIDEO_CACHE,
                 ), timeout=VIDEO_DOWNLOAD_TIMEOUT)
         except video_utils.IPBlockedException:
             # IP is blocked, cannot download video, check description only
@@ -145,34 +152,29 @@ async def get_random_video(metadata: List[VideoMetadata], check_video: bool) ->
     return random_metadata, random_video
 
 
-async def random_check(random_meta_and_vid: List[VideoMetadata], imagebind: ImageBind) -> bool:
+async def random_check(random_meta_and_vid: List[VideoMetadata], imagebind: InferenceScheduler) -> bool:
     random_metadata, random_video = random_meta_and_vid
 
     if random_video is None:
         desc_embeddings = await imagebind.embed_text_async([random_metadata.description])
-        return is_similar(desc_embeddings, random_metadata.description_emb)
+        return is_similar(desc_embeddings, random_metadata.get_embedding("description_emb"))
 
     # Video downloaded, check all embeddings
     embeddings = await imagebind.embed_async([random_metadata.description], [random_video])
     return (
-        is_similar(embeddings.video, random_metadata.video_emb) and
-        is_similar(embeddings.audio, random_metadata.audio_emb) and
-        is_similar(embeddings.description, random_metadata.description_emb)
+        is_similar(embeddings.video, random_metadata.get_embedding("video_emb")) and
+        is_similar(embeddings.audio, random_metadata.get_embedding("audio_emb")) and
+        is_similar(embeddings.description, random_metadata.get_embedding("description_emb"))
     )
 
 
 async def get_num_unique_videos(videos: Videos) -> int:
-    metadata = videos.video_metadata
-    embeddings = Embeddings(
-        video=torch.stack([torch.tensor(v.video_emb) for v in metadata]),
-        audio=torch.stack([torch.tensor(v.audio_emb) for v in metadata]),
-        description=torch.stack([torch.tensor(v.description_emb) for v in metadata]),
-    )
+    embeddings = stack_embeddings(videos.video_metadata)
     novelty_score, is_too_similar = await compute_novelty_score(embeddings, already_uploaded=False)
     return sum([not is_sim for is_sim in is_too_similar])
 
 
-async def _run_video_scoring(videos: Videos, imagebind: ImageBind, is_check_only: bool) -> float:
+async def _run_video_scoring(videos: Videos, imagebind: InferenceScheduler, is_check_only: bool) -> float:
     if any(not video_utils.is_valid_id(video.video_id) for video in videos.video_metadata):
         return {"score": FAKE_VIDEO_PUNISHMENT}
 
@@ -187,19 +189,17 @@ async def _run_video_scoring(videos: Videos, imagebind: ImageBind, is_check_only
     if random_meta_and_vid is None:
         return {"score": FAKE_VIDEO_PUNISHMENT}
 
-    async with GPU_SEMAPHORE:
-        passed_check = await random_check(random_meta_and_vid, imagebind)
-        if not passed_check:
-            return {"score": FAKE_VIDEO_PUNISHMENT}
-        query_emb = await imagebind.embed_text_async([videos.query])
+    # model calls are serialized and batched across requests by the inference scheduler
+    passed_check, query_emb = await asyncio.gather(
+        random_check(random_meta_and_vid, imagebind),
+        imagebind.embed_text_async([videos.query]),
+    )
+    if not passed_check:
+        return {"score": FAKE_VIDEO_PUNISHMENT}
 
     # Upload the videos to Pinecone and deduplicate
     original_length = len(metadata)
-    embeddings = Embeddings(
-        video=torch.stack([torch.tensor(v.video_emb) for v in metadata]).to(imagebind.device),
-        audio=torch.stack([torch.tensor(v.audio_emb) for v in metadata]).to(imagebind.device),
-        description=torch.stack([torch.tensor(v.description_emb) for v in metadata]).to(imagebind.device),
-    )
+    embeddings = stack_embeddings(metadata, imagebind.device)
     if not is_check_only:
         video_ids = await run_async(upload_to_pinecone, embeddings, metadata)
     novelty_score, is_too_similar = await compute_novelty_score(embeddings, already_uploaded=(not is_check_only))
@@ -247,10 +247,10 @@ async def _run_video_scoring(videos: Videos, imagebind: ImageBind, is_check_only
     }
 
 
-async def score_videos_for_testing(videos: Videos, imagebind: ImageBind) -> float:
+async def score_videos_for_testing(videos: Videos, imagebind: InferenceScheduler) -> float:
     return await _run_video_scoring(videos, imagebind, is_check_only=True)
 
 
-async def score_and_upload_videos(videos: Videos, imagebind: ImageBind) -> float:
+async def score_and_upload_videos(videos: Videos, imagebind: InferenceScheduler) -> float:
     scores_dict = await _run_video_scoring(videos, imagebind, is_check_only=False)
     return scores_dict["score"]